@@ -2,8 +2,10 @@ from database.models import User
 from datetime import datetime
 import logging
 import asyncio
+import os
+import re
 import signal
-import traceback
+from sqlalchemy import delete
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, filters
 from telegram import Update
 from config import BOT_TOKEN, ADMINS, DB_ENGINE
@@ -22,38 +24,89 @@ logger = logging.getLogger(__name__)
 # Глобальные переменные для управления состоянием бота
 application = None
 notification_service = None
-running = False
-
-
-async def shutdown(signal_name=None):
+stop_event = None
+active_flush_task = None
+
+IS_POSIX = os.name == 'posix'
+
+# Шаблоны callback_data, скомпилированные один раз при загрузке модуля
+QUIZ_CALLBACK_RE = re.compile(r'^quiz_', re.ASCII)
+PARENT_CALLBACK_RE = re.compile(r'^parent_', re.ASCII)
+ADMIN_CALLBACK_RE = re.compile(r'^admin_', re.ASCII)
+COMMON_CALLBACK_RE = re.compile(r'^common_', re.ASCII)
+
+# Обработчики обновлений в порядке проверки диспетчером: сначала самые частые
+# обновления (текст и нажатия кнопок), затем команды, редкие команды в конце.
+# Фильтры обработчиков не пересекаются, поэтому порядок влияет только на число проверок
+HANDLERS = [
+    # Обработка обычных текстовых сообщений
+    MessageHandler(filters.TEXT & ~filters.COMMAND, common.handle_message),
+
+    # Обработка кнопок и inline-клавиатур
+    CallbackQueryHandler(student.handle_test_button, pattern=QUIZ_CALLBACK_RE),
+    CallbackQueryHandler(common.handle_common_button, pattern=COMMON_CALLBACK_RE),
+    CallbackQueryHandler(parent.handle_parent_button, pattern=PARENT_CALLBACK_RE),
+    CallbackQueryHandler(admin.handle_admin_button, pattern=ADMIN_CALLBACK_RE),
+
+    # Команды
+    CommandHandler("start", start.start_command),
+    CommandHandler("help", start.help_command),
+
+    # Обработчики для ученика
+    CommandHandler("test", student.start_test),
+    CommandHandler("stats", student.show_stats),
+    CommandHandler("achievements", student.show_achievements),
+    CommandHandler("mycode", start.mycode_command),
+
+    # Обработчики для родителя
+    CommandHandler("link", parent.link_student),
+    CommandHandler("report", parent.get_report),
+    CommandHandler("settings", parent.settings),
+
+    # Обработка загруженных файлов
+    MessageHandler(filters.Document.ALL, admin.handle_document),
+
+    # Обработчики для администратора
+    CommandHandler("admin", admin.admin_panel),
+    CommandHandler("add_question", admin.add_question),
+    CommandHandler("import", admin.import_questions),
+]
+
+
+async def shutdown():
     """Корректное завершение работы бота"""
-    global running, application, notification_service
+    global application, notification_service, active_flush_task
 
-    if not running:
-        return
-
-    logger.info(f"Shutting down bot{f' (signal: {signal_name})' if signal_name else ''}")
-    running = False
+    logger.info("Shutting down bot")
 
     try:
         if notification_service:
             await notification_service.stop()
 
-        if application and application.updater.running:
+        # Останавливаем фоновую запись активности и сохраняем накопленные отметки
+        if active_flush_task:
+            active_flush_task.cancel()
+            active_flush_task = None
+            await common.flush_last_active()
+
+        # Каждый шаг проверяет состояние, поэтому повторный вызов или сбой
+        # до application.start() не приводят к ошибке при остановке
+        if application and application.updater and application.updater.running:
             await application.updater.stop()
 
         if application:
-            await application.stop()
+            if application.running:
+                await application.stop()
             await application.shutdown()
 
         logger.info("Bot shutdown complete")
     except Exception as e:
-        logger.error(f"Error during shutdown: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Error during shutdown: {e}")
 
 
 async def test_db():
     """Тестирование работы с базой данных"""
+    created_id = None
     try:
         logger.info("Тестирование создания пользователя")
         with get_session() as session:
@@ -64,11 +117,11 @@ async def test_db():
                 full_name="Test User",
                 role="parent",
                 created_at=datetime.utcnow(),
-                last_active=datetime.utcnow(),
-                settings='{}'
+                last_active=datetime.utcnow()
             )
             session.add(test_user)
             session.commit()
+            created_id = test_user.id
 
             # Проверяем, что пользователь действительно создан
             created_user = session.query(User).filter(User.telegram_id == 9999999).first()
@@ -78,12 +131,15 @@ async def test_db():
                 logger.error("Ошибка! Тестовый пользователь не найден после создания")
 
     except Exception as e:
-        logger.error(f"Ошибка при тестировании базы данных: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Ошибка при тестировании базы данных: {e}")
+    finally:
+        # Удаляем только созданную проверкой запись
+        _delete_test_user(created_id)
 
 
 async def test_db_detailed():
     """Детальное тестирование работы с базой данных"""
+    created_id = None
     try:
         from database.models import User
         from sqlalchemy import inspect
@@ -128,12 +184,12 @@ async def test_db_detailed():
                 telegram_id=6666666,
                 username="test_creation",
                 full_name="Test Creation",
-                role="parent",
-                settings='{}'
+                role="parent"
             )
             session.add(test_user)
             logger.info("Пользователь добавлен, коммит...")
             session.commit()
+            created_id = test_user.id
             logger.info("Транзакция зафиксирована")
 
             # Проверка в той же сессии
@@ -156,19 +212,35 @@ async def test_db_detailed():
         logger.info("--- Завершение детального тестирования базы данных ---")
 
     except Exception as e:
-        logger.error(f"Ошибка при детальном тестировании базы данных: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Ошибка при детальном тестировании базы данных: {e}")
+    finally:
+        # Удаляем только созданную проверкой запись
+        _delete_test_user(created_id)
 
 
+def _delete_test_user(user_id) -> None:
+    """Удаление пользователя, созданного отладочной проверкой (по его первичному ключу)"""
+    if user_id is None:
+        return
+    with get_session() as session:
+        session.execute(delete(User).where(User.id == user_id))
+        session.commit()
+    logger.info(f"Тестовый пользователь {user_id} удален")
+
 
 async def main():
     """Запуск бота"""
-    global running, application, notification_service
-    await test_db()
-    await test_db_detailed()
+    global application, notification_service, stop_event, active_flush_task
+    stop_event = asyncio.Event()
     try:
-        # Инициализация базы данных
-        init_db()
+        # Инициализация базы данных выполняется в отдельном потоке,
+        # чтобы синхронные вызовы SQLAlchemy не блокировали цикл событий
+        await asyncio.to_thread(init_db)
+
+        # Отладочные проверки базы данных запускаются только по запросу
+        if os.getenv("BOT_DEBUG_DB") == "1":
+            await test_db()
+            await test_db_detailed()
 
         # Создание экземпляра приложения с настройками таймаутов
         application = (
@@ -178,40 +250,15 @@ async def main():
             .write_timeout(30)
             .connect_timeout(30)
             .pool_timeout(30)
+            .connection_pool_size(256)  # Общий пул соединений для ответов и рассылки уведомлений
             .build()
         )
 
-        # Регистрация обработчиков команд
-        application.add_handler(CommandHandler("start", start.start_command))
-        application.add_handler(CommandHandler("help", start.help_command))
-
-        # Обработчики для ученика
-        application.add_handler(CommandHandler("test", student.start_test))
-        application.add_handler(CommandHandler("stats", student.show_stats))
-        application.add_handler(CommandHandler("achievements", student.show_achievements))
-        application.add_handler(CommandHandler("mycode", start.mycode_command))
-
-        # Обработчики для родителя
-        application.add_handler(CommandHandler("link", parent.link_student))
-        application.add_handler(CommandHandler("report", parent.get_report))
-        application.add_handler(CommandHandler("settings", parent.settings))
+        # Таблица маршрутизации кнопок меню (после загрузки всех модулей handlers)
+        common._resolve_handlers()
 
-        # Обработчики для администратора
-        application.add_handler(CommandHandler("admin", admin.admin_panel))
-        application.add_handler(CommandHandler("add_question", admin.add_question))
-        application.add_handler(CommandHandler("import", admin.import_questions))
-
-        # Обработка кнопок и inline-клавиатур
-        application.add_handler(CallbackQueryHandler(student.handle_test_button, pattern=r'^quiz_'))
-        application.add_handler(CallbackQueryHandler(parent.handle_parent_button, pattern=r'^parent_'))
-        application.add_handler(CallbackQueryHandler(admin.handle_admin_button, pattern=r'^admin_'))
-        application.add_handler(CallbackQueryHandler(common.handle_common_button, pattern=r'^common_'))
-
-        # Обработка обычных текстовых сообщений
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, common.handle_message))
-
-        # Обработка загруженных файлов
-        application.add_handler(MessageHandler(filters.Document.ALL, admin.handle_document))
+        # Регистрация всех обработчиков одним вызовом
+        application.add_handlers(HANDLERS)
 
         # Обработка ошибок
         application.add_error_handler(common.error_handler)
@@ -221,35 +268,30 @@ async def main():
         await notification_service.start()
 
         # Установка обработчиков сигналов для корректного завершения
-        import platform
-        if platform.system() != 'Windows':  # Только для Unix-подобных систем
-            import signal
+        if IS_POSIX:  # add_signal_handler доступен только в Unix-подобных системах
+            loop = asyncio.get_running_loop()
             for sig in (signal.SIGINT, signal.SIGTERM):
-                loop = asyncio.get_running_loop()
-                loop.add_signal_handler(
-                    sig,
-                    lambda s=sig: asyncio.create_task(shutdown(s.name))
-                )
+                loop.add_signal_handler(sig, stop_event.set)
 
         # Запуск бота
-        running = True
         await application.initialize()
         await application.start()
         logger.info("Bot started")
 
+        # Пакетная запись времени последней активности пользователей
+        active_flush_task = asyncio.create_task(common.flush_last_active_loop())
+
         # Запускаем polling и ждем завершения
         await application.updater.start_polling(
             allowed_updates=Update.ALL_TYPES,
             drop_pending_updates=True
         )
 
-        # Бесконечный цикл, чтобы бот работал до получения сигнала завершения
-        while running:
-            await asyncio.sleep(1)
+        # Ждем сигнала завершения
+        await stop_event.wait()
 
     except Exception as e:
-        logger.error(f"Error during bot execution: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Error during bot execution: {e}")
     finally:
         await shutdown()
 
@@ -261,5 +303,4 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         logger.info("Bot stopped by user")
     except Exception as e:
-        logger.error(f"Critical error: {e}")
-        logger.error(traceback.format_exc())
\ No newline at end of file
+        logger.exception(f"Critical error: {e}")
\ No newline at end of file
@@ -7,13 +7,24 @@ load_dotenv()
 # Токен для доступа к API Telegram
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 
-# Идентификаторы администраторов (список строк с ID)
-ADMINS = [admin_id.strip() for admin_id in os.getenv('ADMINS', '').split(',') if admin_id.strip()]
+# Идентификаторы администраторов (множество целых ID для проверки за O(1))
+ADMINS = frozenset(int(admin_id) for admin_id in os.getenv('ADMINS', '').split(',') if admin_id.strip())
 
 # Настройки подключения к базе данных
 # Используем нормализованный путь для SQLite
 db_path = os.path.join('data', 'history_bot.db')
 DB_ENGINE = os.getenv('DB_ENGINE', f'sqlite:///{db_path}')
+if DB_ENGINE.startswith('sqlite:///'):
+    # Каталог файла SQLite создается ниже вместе с остальными каталогами данных
+    db_path = DB_ENGINE.replace('sqlite:///', '', 1)
+
+# Параметры пула соединений (для серверных СУБД)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))
+# Адрес внешнего пулера соединений PostgreSQL (PgBouncer и т.п.) в режиме transaction.
+# Если задан, бот подключается через него, а собственный пул SQLAlchemy отключается
+DB_POOLER_URL = os.getenv('DB_POOLER_URL', '')
 
 # Настройки бота
 DEFAULT_QUESTIONS_COUNT = int(os.getenv('DEFAULT_QUESTIONS_COUNT', '10'))
@@ -25,5 +36,5 @@ MEDIA_DIR = os.path.join(DATA_DIR, 'media')
 QUESTIONS_DIR = os.path.join(DATA_DIR, 'questions')
 
 # Убедимся, что все необходимые директории существуют
-for directory in [DATA_DIR, MEDIA_DIR, QUESTIONS_DIR, os.path.dirname(db_path)]:
-    os.makedirs(directory, exist_ok=True)
\ No newline at end of file
+for directory in [DATA_DIR, MEDIA_DIR, QUESTIONS_DIR, os.path.dirname(os.path.abspath(db_path))]:
+    os.makedirs(directory, exist_ok=True)
@@ -1,57 +1,112 @@
+import functools
 import logging
-import os
-import traceback
+import threading
+import orjson
 from contextlib import contextmanager
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from cachetools import TTLCache
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
 
-from config import DB_ENGINE, DATA_DIR
-from database.models import Base
+from config import DB_ENGINE, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOLER_URL
+from database.models import Base, User
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
-# Создаем директорию для базы данных, если она не существует
-os.makedirs(os.path.dirname(DB_ENGINE.replace('sqlite:///', '')), exist_ok=True)
+
+def _json_dumps(value) -> str:
+    """Сериализация JSON-столбцов через orjson (драйверу нужна строка, а не bytes)"""
+    return orjson.dumps(value).decode()
+
+
+# Сериализация JSON-столбцов (настройки пользователей, варианты ответов) на orjson
+_JSON_OPTIONS = {"json_serializer": _json_dumps, "json_deserializer": orjson.loads}
 
 # Создаем движок базы данных с настройками для SQLite
 if DB_ENGINE.startswith('sqlite:///'):
+    # Для файловой SQLite SQLAlchemy 2.x уже использует QueuePool,
+    # поэтому каждая сессия получает собственное соединение. Размер пула
+    # берем из настроек: стандартных 5 + 10 не хватает при одновременных
+    # обработчиках и импорте в рабочем потоке
     engine = create_engine(
         DB_ENGINE,
         connect_args={"check_same_thread": False},  # Для SQLite
-        echo=False  # Установите True для отладки SQL-запросов
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        echo=False,  # Установите True для отладки SQL-запросов
+        **_JSON_OPTIONS
+    )
+elif DB_POOLER_URL:
+    # Соединения держит внешний пулер: второй пул поверх него только занимает
+    # серверные слоты, а в режиме transaction соединение не закреплено за сессией
+    engine = create_engine(
+        DB_POOLER_URL,
+        poolclass=NullPool,
+        echo=False,
+        **_JSON_OPTIONS
     )
 else:
-    engine = create_engine(DB_ENGINE, echo=False)
+    engine = create_engine(
+        DB_ENGINE,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_pre_ping=True,  # Проверка соединения перед выдачей из пула
+        pool_recycle=DB_POOL_RECYCLE,
+        echo=False,
+        **_JSON_OPTIONS
+    )
 
-# Создаем фабрику сессий
-Session = scoped_session(sessionmaker(bind=engine, autoflush=True, autocommit=False))
+if DB_ENGINE.startswith('sqlite'):
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragma(dbapi_connection, connection_record):
+        """Настройка SQLite при открытии соединения: WAL и менее частый fsync"""
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-20000")
+        cursor.close()
+
+# Кэш (id, role) пользователей по telegram_id для частых проверок роли.
+# Сессии используются и из рабочих потоков, поэтому доступ защищен блокировкой
+user_cache = TTLCache(maxsize=10000, ttl=60)
+_user_cache_lock = threading.Lock()
+
+# Создаем фабрику сессий. Автоматический flush перед каждым запросом отключен:
+# места, где нужен ID до commit, вызывают session.flush() явно
+SessionLocal = sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
 
 def init_db():
     """Инициализация базы данных"""
     try:
-        # Проверяем и создаем директорию для SQLite
+        # Каталог для файла SQLite уже создан при загрузке config
         if DB_ENGINE.startswith('sqlite:///'):
             db_path = DB_ENGINE.replace('sqlite:///', '')
-            db_dir = os.path.dirname(os.path.abspath(db_path))
-            # Проверка прав на запись
-            test_file = os.path.join(db_dir, 'test_write.tmp')
-            try:
-                with open(test_file, 'w') as f:
-                    f.write('test')
-                os.remove(test_file)
-                logger.info(f"Проверка прав на запись в директорию {db_dir} успешна")
-            except Exception as e:
-                logger.error(f"Ошибка при проверке прав на запись в директорию {db_dir}: {e}")
-
-            logger.info(f"База данных SQLite будет создана по пути: {db_path}")
-            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
             logger.info(f"База данных SQLite будет создана по пути: {db_path}")
 
         # Создаем все таблицы
         Base.metadata.create_all(engine)
         logger.info("Таблицы в базе данных созданы успешно")
 
+        # create_all не добавляет индексы в уже существующие таблицы: без них поиск
+        # по telegram_id и выборки по role/last_active превращаются в полный просмотр
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                try:
+                    index.create(engine, checkfirst=True)
+                except IntegrityError as e:
+                    # Уникальный индекс не создается поверх уже существующих дублей:
+                    # их нужно устранить вручную, до этого проверки выполняет код
+                    logger.warning(
+                        f"Не удалось создать уникальный индекс {index.name}: "
+                        f"в таблице {table.name} есть повторяющиеся значения ({e.orig})"
+                    )
+                except Exception as e:
+                    logger.warning(f"Не удалось создать индекс {index.name}: {e}")
+
         # Проверяем, есть ли уже данные в базе
         with get_session() as session:
             from database.models import User
@@ -66,30 +121,54 @@ def init_db():
                 logger.info("База данных уже содержит данные, пропускаем добавление начальных данных")
 
     except Exception as e:
-        logger.error(f"Ошибка инициализации базы данных: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Ошибка инициализации базы данных: {e}")
         raise
 
 
 @contextmanager
 def get_session():
     """Контекстный менеджер для работы с сессией базы данных"""
-    session = Session()
+    session = SessionLocal()
     try:
         logger.debug("Открыта новая сессия базы данных")
         yield session
-        session.commit()
-        logger.debug("Сессия успешно закрыта с commit")
+        # Для блоков только на чтение commit не нужен: незавершенная транзакция
+        # откатывается при закрытии сессии. Запись через session.execute()
+        # не отражается в new/dirty/deleted и фиксируется вызывающим кодом явно
+        if session.new or session.dirty or session.deleted:
+            session.commit()
+            logger.debug("Сессия успешно закрыта с commit")
     except Exception as e:
         session.rollback()
-        logger.error(f"Ошибка в сессии базы данных, выполнен rollback: {e}")
-        logger.error(traceback.format_exc())
+        logger.exception(f"Ошибка в сессии базы данных, выполнен rollback: {e}")
         raise
     finally:
         session.close()
         logger.debug("Сессия закрыта в блоке finally")
 
 
+def transactional(func):
+    """Декоратор для операций записи: открывает сессию, передает ее функции
+    первым аргументом и фиксирует всю операцию одним commit
+
+    При ошибке базы данных get_session откатывает транзакцию, а вызывающий код
+    получает словарь {"success": False, "message": ...} вместо исключения.
+    Остальные исключения (ошибки в коде) не перехватываются и доходят
+    до общего обработчика ошибок.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            with get_session() as session:
+                result = func(session, *args, **kwargs)
+                session.commit()
+                return result
+        except SQLAlchemyError:
+            logger.exception(f"Error in {func.__name__}")
+            return {"success": False, "message": "Ошибка базы данных. Подробности записаны в лог."}
+    return wrapper
+
+
 def add_default_data():
     """Добавление начальных данных в базу данных"""
     from database.models import User, Topic
@@ -101,13 +180,12 @@ def add_default_data():
 
             if not admin_exists:
                 # Добавляем администратора (ID нужно заменить на реальный)
-                admin = User(
-                    telegram_id=123456789,  # Замените на реальный ID
-                    username="admin",
-                    full_name="Admin",
-                    role="admin"
-                )
-                session.add(admin)
+                session.execute(insert(User), [{
+                    "telegram_id": 123456789,  # Замените на реальный ID
+                    "username": "admin",
+                    "full_name": "Admin",
+                    "role": "admin"
+                }])
                 logger.info("Default admin user added")
 
             # Проверяем, есть ли уже темы
@@ -115,31 +193,83 @@ def add_default_data():
 
             if not topics_exist:
                 # Добавляем несколько начальных тем
-                topics = [
-                    Topic(name="Древняя Русь IX-XII вв.",
-                          description="Вопросы по истории Древней Руси в период IX-XII веков"),
-                    Topic(name="Русь в XIII-XV вв.", description="Вопросы по истории Руси в период XIII-XV веков"),
-                    Topic(name="Россия в XVI-XVII вв.",
-                          description="Вопросы по истории России в период XVI-XVII веков"),
-                    Topic(name="Российская империя в XVIII в.",
-                          description="Вопросы по истории Российской империи в XVIII веке"),
-                    Topic(name="Российская империя в XIX - начале XX в.",
-                          description="Вопросы по истории Российской империи в XIX - начале XX века"),
-                    Topic(name="Революция и Гражданская война",
-                          description="Вопросы по истории Революции и Гражданской войны"),
-                    Topic(name="СССР в 1922-1941 гг.", description="Вопросы по истории СССР в межвоенный период"),
-                    Topic(name="Великая Отечественная война",
-                          description="Вопросы по истории Великой Отечественной войны"),
-                    Topic(name="СССР в 1945-1991 гг.", description="Вопросы по истории СССР в послевоенный период"),
-                    Topic(name="Российская Федерация", description="Вопросы по истории современной России")
+                topic_rows = [
+                    {"name": "Древняя Русь IX-XII вв.",
+                     "description": "Вопросы по истории Древней Руси в период IX-XII веков"},
+                    {"name": "Русь в XIII-XV вв.",
+                     "description": "Вопросы по истории Руси в период XIII-XV веков"},
+                    {"name": "Россия в XVI-XVII вв.",
+                     "description": "Вопросы по истории России в период XVI-XVII веков"},
+                    {"name": "Российская империя в XVIII в.",
+                     "description": "Вопросы по истории Российской империи в XVIII веке"},
+                    {"name": "Российская империя в XIX - начале XX в.",
+                     "description": "Вопросы по истории Российской империи в XIX - начале XX века"},
+                    {"name": "Революция и Гражданская война",
+                     "description": "Вопросы по истории Революции и Гражданской войны"},
+                    {"name": "СССР в 1922-1941 гг.",
+                     "description": "Вопросы по истории СССР в межвоенный период"},
+                    {"name": "Великая Отечественная война",
+                     "description": "Вопросы по истории Великой Отечественной войны"},
+                    {"name": "СССР в 1945-1991 гг.",
+                     "description": "Вопросы по истории СССР в послевоенный период"},
+                    {"name": "Российская Федерация",
+                     "description": "Вопросы по истории современной России"}
                 ]
 
-                session.add_all(topics)
+                # Одна пакетная вставка вместо отдельного INSERT на каждую тему
+                session.execute(insert(Topic), topic_rows)
                 logger.info("Default topics added")
 
             session.commit()
             logger.info("Default data added successfully")
 
     except Exception as e:
-        logger.error(f"Error adding default data: {e}")
-        raise
\ No newline at end of file
+        logger.exception(f"Error adding default data: {e}")
+        raise
+
+
+def get_user_by_tg(tg_id: int, session=None):
+    """Получение (id, role) пользователя по telegram_id с кэшированием
+
+    Возвращает кортеж (id, role) или None, если пользователь не найден.
+    """
+    with _user_cache_lock:
+        cached = user_cache.get(tg_id)
+    if cached is not None:
+        return cached
+
+    if session is None:
+        with get_session() as own_session:
+            return get_user_by_tg(tg_id, own_session)
+
+    # Выбираем только нужные столбцы, без загрузки ORM-объекта целиком
+    row = session.query(User.id, User.role).filter(User.telegram_id == tg_id).first()
+    if row is None:
+        return None
+
+    cached = tuple(row)
+    with _user_cache_lock:
+        user_cache[tg_id] = cached
+    return cached
+
+
+def get_user_role(tg_id: int, session=None):
+    """Роль пользователя по telegram_id из кэша (None, если пользователь не найден)
+
+    Записи кэша сбрасываются через invalidate_user() при смене роли.
+    """
+    cached = get_user_by_tg(tg_id, session)
+    return cached[1] if cached is not None else None
+
+
+def peek_user_role(tg_id: int):
+    """Роль пользователя только из кэша, без обращения к БД (None при промахе)"""
+    with _user_cache_lock:
+        cached = user_cache.get(tg_id)
+    return cached[1] if cached is not None else None
+
+
+def invalidate_user(tg_id: int) -> None:
+    """Сброс кэшированных данных пользователя после изменения записи"""
+    with _user_cache_lock:
+        user_cache.pop(tg_id, None)
\ No newline at end of file
@@ -1,40 +1,58 @@
-from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Table
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, Float, Boolean, DateTime, ForeignKey, Table, Index, JSON
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.associationproxy import association_proxy
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 
 Base = declarative_base()
 
-# Связующая таблица для отношения многие-ко-многим между Question и TestResult
-question_result = Table(
-    'question_result',
-    Base.metadata,
-    Column('question_id', Integer, ForeignKey('questions.id')),
-    Column('test_result_id', Integer, ForeignKey('test_results.id')),
-    Column('is_correct', Boolean, default=False),
-    Column('user_answer', String),
-)
+
+class utcnow(FunctionElement):
+    """Текущее время UTC на стороне БД (naive, как datetime.utcnow() в остальном коде)"""
+    type = DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow_default(element, compiler, **kw):
+    # В SQLite CURRENT_TIMESTAMP уже возвращает UTC
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, "postgresql")
+def _utcnow_postgresql(element, compiler, **kw):
+    # now() возвращает время в часовом поясе сессии, поэтому приводим его к UTC
+    return "(now() at time zone 'utc')"
 
 # Связующая таблица для родитель-ученик
 parent_student = Table(
     'parent_student',
     Base.metadata,
-    Column('parent_id', Integer, ForeignKey('users.id')),
-    Column('student_id', Integer, ForeignKey('users.id')),
+    Column('parent_id', Integer, ForeignKey('users.id'), index=True),
+    Column('student_id', Integer, ForeignKey('users.id'), index=True),
 )
 
 
 class User(Base):
     __tablename__ = 'users'
+    __table_args__ = (
+        # Подсчет по ролям и поиск неактивных учеников (role + last_active)
+        Index('ix_user_role_last_active', 'role', 'last_active'),
+        # Список недавно активных пользователей (ORDER BY last_active DESC LIMIT)
+        Index('ix_user_last_active', 'last_active'),
+    )
 
     id = Column(Integer, primary_key=True)
-    telegram_id = Column(Integer, unique=True, nullable=False)
+    telegram_id = Column(BigInteger, unique=True, nullable=False, index=True)  # ID Telegram превышают 2^31
     username = Column(String, nullable=True)
     full_name = Column(String, nullable=True)
     role = Column(String, nullable=False)  # student, parent, admin
-    created_at = Column(DateTime, default=datetime.utcnow)
-    last_active = Column(DateTime, default=datetime.utcnow)
-    settings = Column(String, nullable=True)  # JSON строка с настройками пользователя
+    created_at = Column(DateTime, default=utcnow())
+    last_active = Column(DateTime, default=utcnow())
+    # Настройки пользователя (JSON, в PostgreSQL - JSONB); пустой объект по умолчанию
+    settings = Column(JSON().with_variant(JSONB, "postgresql"), nullable=True, default=dict)
 
     # Отношения
     results = relationship("TestResult", back_populates="user")
@@ -54,7 +72,9 @@ class Topic(Base):
     __tablename__ = 'topics'
 
     id = Column(Integer, primary_key=True)
-    name = Column(String, nullable=False)
+    # Уникальный индекс (а не ограничение столбца), чтобы init_db мог добавить его
+    # и в базы, созданные до появления проверки уникальности
+    name = Column(String, nullable=False, unique=True, index=True)
     description = Column(String, nullable=True)
 
     # Отношения
@@ -65,10 +85,12 @@ class Question(Base):
     __tablename__ = 'questions'
 
     id = Column(Integer, primary_key=True)
-    topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False)
+    topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False, index=True)
     text = Column(String, nullable=False)
-    options = Column(String, nullable=False)  # JSON строка с вариантами ответов
-    correct_answer = Column(String, nullable=False)  # JSON строка с правильными ответами
+    # Варианты и правильные ответы хранятся как JSON (JSONB в PostgreSQL),
+    # сериализацию выполняет драйвер, а не код обработчиков
+    options = Column(JSON().with_variant(JSONB, "postgresql"), nullable=False)  # Список вариантов ответов
+    correct_answer = Column(JSON().with_variant(JSONB, "postgresql"), nullable=False)  # Список правильных ответов
     question_type = Column(String, nullable=False)  # single, multiple
     difficulty = Column(Integer, default=1)  # 1-5
     media_url = Column(String, nullable=True)  # URL или путь к медиа-файлу
@@ -76,35 +98,54 @@ class Question(Base):
 
     # Отношения
     topic = relationship("Topic", back_populates="questions")
-    test_results = relationship("TestResult", secondary=question_result, back_populates="questions")
+    answers = relationship("QuestionResult", back_populates="question")
+    test_results = association_proxy("answers", "test_result")
 
 
 class TestResult(Base):
     __tablename__ = 'test_results'
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
-    topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    topic_id = Column(Integer, ForeignKey('topics.id'), nullable=False, index=True)
     score = Column(Float, nullable=False)
     max_score = Column(Float, nullable=False)
     percentage = Column(Float, nullable=False)
     time_spent = Column(Integer, nullable=True)  # в секундах
-    completed_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime, default=utcnow())
 
     # Отношения
     user = relationship("User", back_populates="results")
     topic = relationship("Topic")
-    questions = relationship("Question", secondary=question_result, back_populates="test_results")
+    # Ответы загружаются лениво: запросы, которым они нужны, подключают selectinload явно
+    answers = relationship("QuestionResult", back_populates="test_result", cascade="all, delete-orphan")
+    questions = association_proxy("answers", "question")
+
+
+class QuestionResult(Base):
+    """Ответ ученика на вопрос в рамках результата теста"""
+    __tablename__ = 'question_result'
+
+    # Составной первичный ключ (test_result_id, question_id) сам служит индексом
+    # для выборки ответов результата; обратный поиск по вопросу - индекс question_id
+    test_result_id = Column(Integer, ForeignKey('test_results.id'), primary_key=True)
+    question_id = Column(Integer, ForeignKey('questions.id'), primary_key=True, index=True)
+    is_correct = Column(Boolean, default=False)
+    user_answer = Column(String)
+
+    # Отношения
+    test_result = relationship("TestResult", back_populates="answers")
+    question = relationship("Question", back_populates="answers")
 
 
 class Achievement(Base):
     __tablename__ = 'achievements'
 
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
     name = Column(String, nullable=False)
     description = Column(String, nullable=True)
-    achieved_at = Column(DateTime, default=datetime.utcnow)
+    achieved_at = Column(DateTime, default=utcnow())
     badge_url = Column(String, nullable=True)
     points = Column(Integer, default=0)
 
@@ -114,13 +155,18 @@ class Achievement(Base):
 
 class Notification(Base):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        # Выборка неотправленных уведомлений: is_read = False AND scheduled_at <= now
+        Index('ix_notif_pending', 'user_id', 'is_read', 'scheduled_at'),
+        Index('ix_notif_due', 'is_read', 'scheduled_at'),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     title = Column(String, nullable=False)
     message = Column(String, nullable=False)
     is_read = Column(Boolean, default=False)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=utcnow())
     scheduled_at = Column(DateTime, nullable=True)
     notification_type = Column(String, nullable=False)  # reminder, report, achievement
 
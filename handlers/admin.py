@@ -1,51 +1,165 @@
 import logging
-import json
-import os
+import asyncio
+import functools
+import io
+import re
+import threading
+import weakref
+import ijson
+from cachetools import TTLCache
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
+from sqlalchemy import func, insert
+from sqlalchemy import update as sql_update  # Имя update занято аргументом обработчиков
 from sqlalchemy.exc import IntegrityError
 
 from services.stats_service import generate_topic_analytics
+from services import topic_cache
 from database.models import User, Topic, Question
-from database.db_manager import get_session
-from config import ADMINS
+from database.db_manager import get_session, transactional
+from config import ADMINS, DEFAULT_QUESTIONS_COUNT, ENABLE_PARENT_REPORTS
 
 logger = logging.getLogger(__name__)
 
+# Разбор callback_data кнопок с параметром: действие и параметр за один проход
+_CB_RE = re.compile(r"^admin_(set_questions|reports|select_topic|question_type|add_topic|edit_topic)_?(.*)$")
+
+# Блокировки обработки кнопок по chat_id; запись удаляется сама,
+# когда блокировку больше не удерживает ни одна задача обработки
+_chat_locks: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+# Значок роли в списке пользователей (неизвестные роли показываются как администратор)
+_ROLE_EMOJI = {"student": "👨‍🎓", "parent": "👨‍👩‍👧‍👦", "admin": "👨‍💻"}
+
+# Аналитика по темам (агрегация результатов и график) на время TTL;
+# хранятся байты графика, чтобы каждый ответ получал свой BytesIO
+_stats_cache = TTLCache(maxsize=1, ttl=60)
+_stats_cache_lock = threading.Lock()  # Сброс выполняется и из потока импорта
+
+# Неизменяемые клавиатуры создаются один раз при загрузке модуля
+_ADMIN_MAIN_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📊 Статистика по темам", callback_data="admin_topic_stats"),
+        InlineKeyboardButton("👥 Пользователи", callback_data="admin_users")
+    ],
+    [
+        InlineKeyboardButton("➕ Добавить вопрос", callback_data="admin_add_question"),
+        InlineKeyboardButton("📁 Импорт вопросов", callback_data="admin_import")
+    ],
+    [
+        InlineKeyboardButton("✏️ Редактировать темы", callback_data="admin_edit_topics"),
+        InlineKeyboardButton("⚙️ Настройки бота", callback_data="admin_settings")
+    ]
+])
+
+_QUESTION_TYPE_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("Одиночный выбор", callback_data="admin_question_type_single"),
+        InlineKeyboardButton("Множественный выбор", callback_data="admin_question_type_multiple")
+    ],
+    [
+        InlineKeyboardButton("Последовательность", callback_data="admin_question_type_sequence"),
+        InlineKeyboardButton("🔙 Назад", callback_data="admin_back_topics")
+    ]
+])
+
+_BOT_SETTINGS_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔢 Число вопросов", callback_data="admin_setting_questions_count"),
+        InlineKeyboardButton("📊 Отчеты родителям", callback_data="admin_setting_reports")
+    ],
+    [
+        InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
+    ]
+])
+
+_QUESTIONS_COUNT_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("5", callback_data="admin_set_questions_5"),
+     InlineKeyboardButton("10", callback_data="admin_set_questions_10"),
+     InlineKeyboardButton("15", callback_data="admin_set_questions_15"),
+     InlineKeyboardButton("20", callback_data="admin_set_questions_20")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="admin_settings")]
+])
+
+_REPORTS_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton("✅ Включить", callback_data="admin_reports_enable"),
+     InlineKeyboardButton("❌ Отключить", callback_data="admin_reports_disable")],
+    [InlineKeyboardButton("🔙 Назад", callback_data="admin_settings")]
+])
+
+_BACK_TO_SETTINGS_MARKUP = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔙 Назад к настройкам", callback_data="admin_settings")
+]])
+
+_SETTINGS_ERROR_MARKUP = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔙 Назад", callback_data="admin_settings")
+]])
+
+_BACK_TO_MAIN_MARKUP = InlineKeyboardMarkup([[
+    InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
+]])
+
+_USERS_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("👨‍🎓 Ученики", callback_data="admin_list_students"),
+        InlineKeyboardButton("👨‍👩‍👧‍👦 Родители", callback_data="admin_list_parents")
+    ],
+    [
+        InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
+    ]
+])
+
+_AFTER_QUESTION_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("➕ Добавить еще вопрос", callback_data="admin_add_question"),
+        InlineKeyboardButton("🔙 Вернуться в меню", callback_data="admin_back_main")
+    ]
+])
+
+# Инструкция по формату JSON-файла для импорта вопросов
+_IMPORT_HELP_TEXT = """Для импорта вопросов отправьте JSON файл с вопросами.
+
+Структура файла должна соответствовать формату:
+```
+{
+  "topic": {
+    "id": 1,
+    "name": "Название темы",
+    "description": "Описание темы"
+  },
+  "questions": [
+    {
+      "id": 1,
+      "text": "Текст вопроса",
+      "options": ["Вариант 1", "Вариант 2", ...],
+      "correct_answer": [0],
+      "question_type": "single",
+      "difficulty": 1,
+      "explanation": "Объяснение ответа"
+    },
+    ...
+  ]
+}
+```
+
+Отправьте файл как документ в этот чат."""
+
 
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /admin для открытия панели администратора"""
     user_id = update.effective_user.id
 
     # Проверяем, является ли пользователь администратором
-    if str(user_id) not in ADMINS:
+    if user_id not in ADMINS:
         await update.message.reply_text(
             "У вас нет прав для доступа к панели администратора."
         )
         return
 
-    # Создаем клавиатуру админ-панели
-    keyboard = [
-        [
-            InlineKeyboardButton("📊 Статистика по темам", callback_data="admin_topic_stats"),
-            InlineKeyboardButton("👥 Пользователи", callback_data="admin_users")
-        ],
-        [
-            InlineKeyboardButton("➕ Добавить вопрос", callback_data="admin_add_question"),
-            InlineKeyboardButton("📁 Импорт вопросов", callback_data="admin_import")
-        ],
-        [
-            InlineKeyboardButton("✏️ Редактировать темы", callback_data="admin_edit_topics"),
-            InlineKeyboardButton("⚙️ Настройки бота", callback_data="admin_settings")
-        ]
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     await update.message.reply_text(
         "👨‍💻 *Панель администратора*\n\n"
         "Выберите действие из списка ниже:",
-        reply_markup=reply_markup,
+        reply_markup=_ADMIN_MAIN_MARKUP,
         parse_mode="Markdown"
     )
 
@@ -55,15 +169,14 @@ async def add_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     user_id = update.effective_user.id
 
     # Проверяем, является ли пользователь администратором
-    if str(user_id) not in ADMINS:
+    if user_id not in ADMINS:
         await update.message.reply_text(
             "У вас нет прав для добавления вопросов."
         )
         return
 
     # Получаем список тем для выбора
-    with get_session() as session:
-        topics = session.query(Topic).all()
+    topics = await asyncio.to_thread(topic_cache.get_topics_cached)
 
     if not topics:
         await update.message.reply_text(
@@ -73,11 +186,11 @@ async def add_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     # Создаем клавиатуру с выбором темы
     keyboard = []
-    for topic in topics:
+    for topic_id, topic_name, _ in topics:
         keyboard.append([
             InlineKeyboardButton(
-                topic.name,
-                callback_data=f"admin_select_topic_{topic.id}"
+                topic_name,
+                callback_data=f"admin_select_topic_{topic_id}"
             )
         ])
 
@@ -97,37 +210,14 @@ async def import_questions(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     user_id = update.effective_user.id
 
     # Проверяем, является ли пользователь администратором
-    if str(user_id) not in ADMINS:
+    if user_id not in ADMINS:
         await update.message.reply_text(
             "У вас нет прав для импорта вопросов."
         )
         return
 
     await update.message.reply_text(
-        "Для импорта вопросов отправьте JSON файл с вопросами.\n\n"
-        "Структура файла должна соответствовать формату:\n"
-        "```\n"
-        "{\n"
-        '  "topic": {\n'
-        '    "id": 1,\n'
-        '    "name": "Название темы",\n'
-        '    "description": "Описание темы"\n'
-        "  },\n"
-        '  "questions": [\n'
-        "    {\n"
-        '      "id": 1,\n'
-        '      "text": "Текст вопроса",\n'
-        '      "options": ["Вариант 1", "Вариант 2", ...],\n'
-        '      "correct_answer": [0],\n'
-        '      "question_type": "single",\n'
-        '      "difficulty": 1,\n'
-        '      "explanation": "Объяснение ответа"\n'
-        "    },\n"
-        "    ...\n"
-        "  ]\n"
-        "}\n"
-        "```\n\n"
-        "Или просто используйте команду /admin и выберите 'Импорт вопросов'.",
+        _IMPORT_HELP_TEXT,
         parse_mode="Markdown"
     )
 
@@ -138,314 +228,287 @@ async def import_questions(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def handle_admin_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик нажатий кнопок в панели администратора"""
     query = update.callback_query
+    user_id = update.effective_user.id
+
+    # Проверяем права до ответа на нажатие: отказ уходит одним запросом к API
+    if user_id not in ADMINS:
+        await query.answer("У вас нет прав для доступа к панели администратора.", show_alert=True)
+        return
+
     await query.answer()
 
-    user_id = update.effective_user.id
+    # Отвечаем на нажатие сразу, а обработку запускаем отдельной задачей, чтобы
+    # медленные запросы к базе не задерживали обработку других обновлений.
+    # Блокировка на чат сохраняет порядок обработки нажатий внутри одного чата
+    chat_id = update.effective_chat.id
+    lock = _chat_locks.get(chat_id)
+    if lock is None:
+        lock = _chat_locks[chat_id] = asyncio.Lock()
+    context.application.create_task(_dispatch_admin_button(update, context, lock), update=update)
 
-    # Проверяем, является ли пользователь администратором
-    if str(user_id) not in ADMINS:
+
+async def _dispatch_admin_button(update: Update, context: ContextTypes.DEFAULT_TYPE, lock: asyncio.Lock) -> None:
+    """Выполнение действия для нажатой кнопки панели администратора"""
+    query = update.callback_query
+
+    async with lock:
+        try:
+            # Сначала точное совпадение callback_data, затем разбор действия с параметром
+            handler = _EXACT.get(query.data)
+            if handler is not None:
+                await handler(update, context)
+            else:
+                match = _CB_RE.match(query.data)
+                if match:
+                    action, payload = match.groups()
+                    await _PREFIX[action](update, context, payload)
+
+        except Exception:
+            logger.exception("Error in handle_admin_button")
+            await query.edit_message_text(
+                "Произошла ошибка при обработке запроса. Подробности записаны в лог."
+            )
+
+
+async def _on_add_question(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Выбор темы для нового вопроса"""
+    query = update.callback_query
+
+    topics_data = await asyncio.to_thread(topic_cache.get_topics_cached)
+
+    if not topics_data:
         await query.edit_message_text(
-            "У вас нет прав для доступа к панели администратора."
+            "Сначала необходимо создать хотя бы одну тему. Используйте 'Редактировать темы'."
         )
         return
 
-    try:
-        # Используем контекстный менеджер для всех операций с базой данных
-        if query.data == "admin_topic_stats":
-            # Показываем статистику по темам
-            await show_topic_stats(update, context)
+    # Создаем клавиатуру с выбором темы
+    keyboard = []
+    for topic_id, topic_name, _ in topics_data:
+        keyboard.append([
+            InlineKeyboardButton(
+                topic_name,
+                callback_data=f"admin_select_topic_{topic_id}"
+            )
+        ])
 
+    # Добавляем кнопку возврата
+    keyboard.append([
+        InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
+    ])
 
-        elif query.data == "admin_users":
-            # Показываем список пользователей
-            await show_users_list(update, context)
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
-        elif query.data == "admin_add_question":
-            # Переход к добавлению вопроса
-            with get_session() as session:
-                topics = session.query(Topic).all()
+    await query.edit_message_text(
+        "Выберите тему для нового вопроса:",
+        reply_markup=reply_markup
+    )
 
-                # Важно: создаем копию данных, а не используем объекты из сессии напрямую
-                topics_data = [{"id": topic.id, "name": topic.name} for topic in topics]
+    # Устанавливаем состояние для пользователя
+    context.user_data["admin_state"] = "adding_question"
 
-            if not topics_data:
-                await query.edit_message_text(
-                    "Сначала необходимо создать хотя бы одну тему. Используйте 'Редактировать темы'."
-                )
-                return
 
-            # Создаем клавиатуру с выбором темы
-            keyboard = []
-            for topic in topics_data:
-                keyboard.append([
-                    InlineKeyboardButton(
-                        topic["name"],
-                        callback_data=f"admin_select_topic_{topic['id']}"
-                    )
-                ])
-
-            # Добавляем кнопку возврата
-            keyboard.append([
-                InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
-            ])
+async def _on_import(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Инструкция по импорту вопросов"""
+    query = update.callback_query
 
-            reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(
+        _IMPORT_HELP_TEXT,
+        parse_mode="Markdown"
+    )
 
-            await query.edit_message_text(
-                "Выберите тему для нового вопроса:",
-                reply_markup=reply_markup
-            )
+    # Устанавливаем состояние для пользователя
+    context.user_data["admin_state"] = "importing_questions"
 
-            # Устанавливаем состояние для пользователя
-            context.user_data["admin_state"] = "adding_question"
 
-        elif query.data == "admin_import":
-            # Инструкция по импорту вопросов
-            await query.edit_message_text(
-                "Для импорта вопросов отправьте JSON файл с вопросами.\n\n"
-                "Структура файла должна соответствовать формату:\n"
-                "```\n"
-                "{\n"
-                '  "topic": {\n'
-                '    "id": 1,\n'
-                '    "name": "Название темы",\n'
-                '    "description": "Описание темы"\n'
-                "  },\n"
-                '  "questions": [\n'
-                "    {\n"
-                '      "id": 1,\n'
-                '      "text": "Текст вопроса",\n'
-                '      "options": ["Вариант 1", "Вариант 2", ...],\n'
-                '      "correct_answer": [0],\n'
-                '      "question_type": "single",\n'
-                '      "difficulty": 1,\n'
-                '      "explanation": "Объяснение ответа"\n'
-                "    },\n"
-                "    ...\n"
-                "  ]\n"
-                "}\n"
-                "```\n\n"
-                "Отправьте файл как документ в этот чат.",
-                parse_mode="Markdown"
-            )
+async def _on_questions_count_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Меню выбора количества вопросов в тесте"""
+    query = update.callback_query
 
-            # Устанавливаем состояние для пользователя
-            context.user_data["admin_state"] = "importing_questions"
+    await query.edit_message_text(
+        "Укажите количество вопросов в тесте по умолчанию (от 5 до 20):",
+        reply_markup=_QUESTIONS_COUNT_MARKUP
+    )
 
-        elif query.data == "admin_edit_topics":
-            # Редактирование тем
-            await show_topics_list(update, context)
 
-        elif query.data == "admin_settings":
-            # Настройки бота
-            await show_bot_settings(update, context)
+async def _on_reports_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Меню настройки отчетов родителям"""
+    query = update.callback_query
 
-        elif query.data == "admin_setting_questions_count":
-            # Обработка настройки количества вопросов в тесте
-            await query.edit_message_text(
-                "Укажите количество вопросов в тесте по умолчанию (от 5 до 20):",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("5", callback_data="admin_set_questions_5"),
-                     InlineKeyboardButton("10", callback_data="admin_set_questions_10"),
-                     InlineKeyboardButton("15", callback_data="admin_set_questions_15"),
-                     InlineKeyboardButton("20", callback_data="admin_set_questions_20")],
-                    [InlineKeyboardButton("🔙 Назад", callback_data="admin_settings")]
-                ])
-            )
+    current_state = "включены" if ENABLE_PARENT_REPORTS else "отключены"
 
-        elif query.data == "admin_setting_reports":
-            # Обработка настройки отчетов родителям
-            from config import ENABLE_PARENT_REPORTS
-            current_state = "включены" if ENABLE_PARENT_REPORTS else "отключены"
+    await query.edit_message_text(
+        f"Автоматические отчеты родителям сейчас {current_state}.\n\n"
+        "Выберите действие:",
+        reply_markup=_REPORTS_MARKUP
+    )
 
-            await query.edit_message_text(
-                f"Автоматические отчеты родителям сейчас {current_state}.\n\n"
-                "Выберите действие:",
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("✅ Включить", callback_data="admin_reports_enable"),
-                     InlineKeyboardButton("❌ Отключить", callback_data="admin_reports_disable")],
-                    [InlineKeyboardButton("🔙 Назад", callback_data="admin_settings")]
-                ])
-            )
 
-        elif query.data.startswith("admin_set_questions_"):
-            # Установка количества вопросов
-            try:
-                questions_count = int(query.data.replace("admin_set_questions_", ""))
+async def _on_set_questions_count(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    """Установка количества вопросов в тесте"""
+    query = update.callback_query
 
-                # Здесь код для сохранения настройки
-                # Например, через изменение переменной окружения или config файла
+    try:
+        questions_count = int(payload)
 
-                await query.edit_message_text(
-                    f"✅ Количество вопросов в тесте установлено: {questions_count}\n\n"
-                    "Настройка будет применена при следующем запуске бота.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("🔙 Назад к настройкам", callback_data="admin_settings")
-                    ]])
-                )
-            except ValueError:
-                await query.edit_message_text(
-                    "Произошла ошибка при установке количества вопросов.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("🔙 Назад", callback_data="admin_settings")
-                    ]])
-                )
+        # Здесь код для сохранения настройки
+        # Например, через изменение переменной окружения или config файла
 
-        elif query.data.startswith("admin_reports_"):
-            # Включение/отключение отчетов
-            action = query.data.replace("admin_reports_", "")
-
-            try:
-                # Здесь код для изменения настройки
-                # Например, через изменение переменной окружения или config файла
-                new_state = "включены" if action == "enable" else "отключены"
-
-                await query.edit_message_text(
-                    f"✅ Автоматические отчеты родителям {new_state}.\n\n"
-                    "Настройка будет применена при следующем запуске бота.",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("🔙 Назад к настройкам", callback_data="admin_settings")
-                    ]])
-                )
-            except Exception as e:
-                await query.edit_message_text(
-                    f"Произошла ошибка при изменении настроек: {str(e)}",
-                    reply_markup=InlineKeyboardMarkup([[
-                        InlineKeyboardButton("🔙 Назад", callback_data="admin_settings")
-                    ]])
-                )
-        elif query.data == "admin_settings":
-            await show_bot_settings(update, context)
-
-        elif query.data.startswith("admin_select_topic_"):
-            # Выбор темы для нового вопроса
-            topic_id = int(query.data.replace("admin_select_topic_", ""))
-            context.user_data["selected_topic_id"] = topic_id
-
-            # Предлагаем выбрать тип вопроса
-            keyboard = [
-                [
-                    InlineKeyboardButton("Одиночный выбор", callback_data="admin_question_type_single"),
-                    InlineKeyboardButton("Множественный выбор", callback_data="admin_question_type_multiple")
-                ],
-                [
-                    InlineKeyboardButton("Последовательность", callback_data="admin_question_type_sequence"),
-                    InlineKeyboardButton("🔙 Назад", callback_data="admin_back_topics")
-                ]
-            ]
+        await query.edit_message_text(
+            f"✅ Количество вопросов в тесте установлено: {questions_count}\n\n"
+            "Настройка будет применена при следующем запуске бота.",
+            reply_markup=_BACK_TO_SETTINGS_MARKUP
+        )
+    except ValueError:
+        await query.edit_message_text(
+            "Произошла ошибка при установке количества вопросов.",
+            reply_markup=_SETTINGS_ERROR_MARKUP
+        )
 
-            reply_markup = InlineKeyboardMarkup(keyboard)
 
-            await query.edit_message_text(
-                "Выберите тип вопроса:",
-                reply_markup=reply_markup
-            )
+async def _on_set_reports(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    """Включение или отключение отчетов родителям"""
+    query = update.callback_query
 
-        elif query.data.startswith("admin_question_type_"):
-            # Выбор типа вопроса
-            question_type = query.data.replace("admin_question_type_", "")
-            context.user_data["question_type"] = question_type
+    action = payload
 
-            # Предлагаем ввести текст вопроса
-            await query.edit_message_text(
-                "Отправьте текст вопроса в следующем сообщении."
-            )
+    try:
+        # Здесь код для изменения настройки
+        # Например, через изменение переменной окружения или config файла
+        new_state = "включены" if action == "enable" else "отключены"
+
+        await query.edit_message_text(
+            f"✅ Автоматические отчеты родителям {new_state}.\n\n"
+            "Настройка будет применена при следующем запуске бота.",
+            reply_markup=_BACK_TO_SETTINGS_MARKUP
+        )
+    except Exception as e:
+        await query.edit_message_text(
+            f"Произошла ошибка при изменении настроек: {str(e)}",
+            reply_markup=_SETTINGS_ERROR_MARKUP
+        )
 
-            # Обновляем состояние
-            context.user_data["admin_state"] = "entering_question_text"
 
-        elif query.data == "admin_back_main":
-            # Возврат в главное меню администратора
-            await show_admin_panel(update, context)
+async def _on_select_topic(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    """Выбор темы для нового вопроса и переход к выбору типа"""
+    query = update.callback_query
 
-        elif query.data == "admin_back_topics":
-            # Возврат к списку тем
-            with get_session() as session:
-                topics = session.query(Topic).all()
+    topic_id = int(payload)
+    context.user_data["selected_topic_id"] = topic_id
 
-            if not topics:
-                await query.edit_message_text(
-                    "Сначала необходимо создать хотя бы одну тему. Используйте 'Редактировать темы'."
-                )
-                return
+    # Предлагаем выбрать тип вопроса
+    await query.edit_message_text(
+        "Выберите тип вопроса:",
+        reply_markup=_QUESTION_TYPE_MARKUP
+    )
 
-            # Создаем клавиатуру с выбором темы
-            keyboard = []
-            for topic in topics:
-                keyboard.append([
-                    InlineKeyboardButton(
-                        topic.name,
-                        callback_data=f"admin_select_topic_{topic.id}"
-                    )
-                ])
-
-            # Добавляем кнопку возврата
-            keyboard.append([
-                InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
-            ])
 
-            reply_markup = InlineKeyboardMarkup(keyboard)
+async def _on_question_type(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    """Выбор типа нового вопроса"""
+    query = update.callback_query
 
-            await query.edit_message_text(
-                "Выберите тему для нового вопроса:",
-                reply_markup=reply_markup
-            )
+    question_type = payload
+    context.user_data["question_type"] = question_type
 
-        elif query.data.startswith("admin_add_topic"):
-            # Добавление новой темы
-            await query.edit_message_text(
-                "Отправьте название и описание новой темы в формате:\n\n"
-                "Название темы\n"
-                "Описание темы"
+    # Предлагаем ввести текст вопроса
+    await query.edit_message_text(
+        "Отправьте текст вопроса в следующем сообщении."
+    )
+
+    # Обновляем состояние
+    context.user_data["admin_state"] = "entering_question_text"
+
+
+async def _on_back_topics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Возврат к выбору темы для нового вопроса"""
+    query = update.callback_query
+
+    topics = await asyncio.to_thread(topic_cache.get_topics_cached)
+
+    if not topics:
+        await query.edit_message_text(
+            "Сначала необходимо создать хотя бы одну тему. Используйте 'Редактировать темы'."
+        )
+        return
+
+    # Создаем клавиатуру с выбором темы
+    keyboard = []
+    for topic_id, topic_name, _ in topics:
+        keyboard.append([
+            InlineKeyboardButton(
+                topic_name,
+                callback_data=f"admin_select_topic_{topic_id}"
             )
+        ])
 
-            # Устанавливаем состояние для пользователя
-            context.user_data["admin_state"] = "adding_topic"
-
-        elif query.data.startswith("admin_edit_topic_"):
-            # Редактирование выбранной темы
-            topic_id = int(query.data.replace("admin_edit_topic_", ""))
-
-            with get_session() as session:
-                topic = session.query(Topic).get(topic_id)
-
-                if not topic:
-                    await query.edit_message_text(
-                        "Тема не найдена."
-                    )
-                    return
-
-                # Создаем клавиатуру с действиями
-                keyboard = [
-                    [
-                        InlineKeyboardButton("✏️ Изменить название", callback_data=f"admin_edit_topic_name_{topic_id}"),
-                        InlineKeyboardButton("📝 Изменить описание", callback_data=f"admin_edit_topic_desc_{topic_id}")
-                    ],
-                    [
-                        InlineKeyboardButton("❌ Удалить тему", callback_data=f"admin_delete_topic_{topic_id}"),
-                        InlineKeyboardButton("🔙 Назад", callback_data="admin_back_topics_list")
-                    ]
-                ]
-
-                reply_markup = InlineKeyboardMarkup(keyboard)
-
-                await query.edit_message_text(
-                    f"*Редактирование темы:* {topic.name}\n\n"
-                    f"*Описание:* {topic.description or 'Нет описания'}\n\n"
-                    "Выберите действие:",
-                    reply_markup=reply_markup,
-                    parse_mode="Markdown"
-                )
+    # Добавляем кнопку возврата
+    keyboard.append([
+        InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
+    ])
 
-        elif query.data == "admin_back_topics_list":
-            # Возврат к списку тем
-            await show_topics_list(update, context)
+    reply_markup = InlineKeyboardMarkup(keyboard)
 
-    except Exception as e:
-        logger.error(f"Error in handle_admin_button: {e}")
+    await query.edit_message_text(
+        "Выберите тему для нового вопроса:",
+        reply_markup=reply_markup
+    )
+
+
+async def _on_add_topic(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    """Запрос названия и описания новой темы"""
+    query = update.callback_query
+
+    await query.edit_message_text(
+        "Отправьте название и описание новой темы в формате:\n\n"
+        "Название темы\n"
+        "Описание темы"
+    )
+
+    # Устанавливаем состояние для пользователя
+    context.user_data["admin_state"] = "adding_topic"
+
+
+def _get_topic(topic_id: int):
+    """Загрузка темы по id (вызывается через asyncio.to_thread)"""
+    with get_session() as session:
+        return session.get(Topic, topic_id)
+
+
+async def _on_edit_topic(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    """Меню редактирования выбранной темы"""
+    query = update.callback_query
+
+    topic_id = int(payload)
+
+    topic = await asyncio.to_thread(_get_topic, topic_id)
+
+    if not topic:
         await query.edit_message_text(
-            f"Произошла ошибка при обработке запроса: {str(e)}"
+            "Тема не найдена."
         )
+        return
+
+    # Создаем клавиатуру с действиями
+    keyboard = [
+        [
+            InlineKeyboardButton("✏️ Изменить название", callback_data=f"admin_edit_topic_name_{topic_id}"),
+            InlineKeyboardButton("📝 Изменить описание", callback_data=f"admin_edit_topic_desc_{topic_id}")
+        ],
+        [
+            InlineKeyboardButton("❌ Удалить тему", callback_data=f"admin_delete_topic_{topic_id}"),
+            InlineKeyboardButton("🔙 Назад", callback_data="admin_back_topics_list")
+        ]
+    ]
+
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    await query.edit_message_text(
+        f"*Редактирование темы:* {topic.name}\n\n"
+        f"*Описание:* {topic.description or 'Нет описания'}\n\n"
+        "Выберите действие:",
+        reply_markup=reply_markup,
+        parse_mode="Markdown"
+    )
 
 
 async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -453,7 +516,7 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = update.effective_user.id
 
     # Проверяем, является ли пользователь администратором
-    if str(user_id) not in ADMINS:
+    if user_id not in ADMINS:
         await update.message.reply_text(
             "У вас нет прав для импорта вопросов."
         )
@@ -472,21 +535,14 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     try:
-        # Скачиваем файл
+        # Скачиваем файл в память, без промежуточного файла на диске
         file = await context.bot.get_file(document.file_id)
-        file_path = f"downloads/{document.file_name}"
-        os.makedirs("downloads", exist_ok=True)
-        await file.download_to_drive(file_path)
-
-        # Обрабатываем файл
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        buf = io.BytesIO()
+        await file.download_to_memory(buf)
 
-        # Импортируем вопросы
-        result = import_questions_from_json(data)
-
-        # Удаляем временный файл
-        os.remove(file_path)
+        # Разбор и запись в БД блокирующие, выполняем их в отдельном потоке,
+        # чтобы не задерживать обработку других чатов
+        result = await asyncio.to_thread(import_questions_from_json_stream, buf)
 
         if result["success"]:
             await update.message.reply_text(
@@ -499,10 +555,10 @@ async def handle_document(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
                 f"❌ Ошибка при импорте: {result['message']}"
             )
 
-    except Exception as e:
-        logger.error(f"Error importing questions: {e}")
+    except Exception:
+        logger.exception("Error importing questions")
         await update.message.reply_text(
-            f"Произошла ошибка при обработке файла: {str(e)}"
+            "Произошла ошибка при обработке файла. Подробности записаны в лог."
         )
 
     # Сбрасываем состояние
@@ -515,7 +571,7 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
     message_text = update.message.text
 
     # Проверяем, является ли пользователь администратором
-    if str(user_id) not in ADMINS:
+    if user_id not in ADMINS:
         await update.message.reply_text(
             "У вас нет прав для выполнения этой операции."
         )
@@ -616,68 +672,63 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         try:
             # Разбиваем ответ на индексы
             answer_indices = [int(idx.strip()) - 1 for idx in message_text.split(',')]
-            options = context.user_data.get("options", [])
-
-            # Проверяем корректность индексов
-            for idx in answer_indices:
-                if idx < 0 or idx >= len(options):
-                    await update.message.reply_text(
-                        f"Указан неверный номер: {idx + 1}. Пожалуйста, выберите числа от 1 до {len(options)}."
-                    )
-                    return
-
-            # Сохраняем правильные ответы
-            context.user_data["correct_answer"] = answer_indices
-
-            # Запрашиваем объяснение
+        except ValueError:
             await update.message.reply_text(
-                "Введите объяснение правильного ответа (или отправьте 'Нет' для пропуска этого шага):"
+                "Пожалуйста, введите числа через запятую. Попробуйте еще раз."
             )
+            return
 
-            context.user_data["admin_state"] = "entering_explanation"
+        options = context.user_data.get("options", [])
 
-        except ValueError:
+        # Проверяем корректность индексов одним сравнением множеств
+        if not set(answer_indices).issubset(range(len(options))):
             await update.message.reply_text(
-                "Пожалуйста, введите числа через запятую. Попробуйте еще раз."
+                f"Указан неверный номер. Пожалуйста, выберите числа от 1 до {len(options)}."
             )
+            return
+
+        # Сохраняем правильные ответы
+        context.user_data["correct_answer"] = answer_indices
+
+        # Запрашиваем объяснение
+        await update.message.reply_text(
+            "Введите объяснение правильного ответа (или отправьте 'Нет' для пропуска этого шага):"
+        )
+
+        context.user_data["admin_state"] = "entering_explanation"
 
     elif state == "entering_correct_answer_sequence":
         try:
             # Разбиваем ответ на индексы
             sequence = [int(idx.strip()) - 1 for idx in message_text.split(',')]
-            options = context.user_data.get("options", [])
-
-            # Проверяем корректность индексов и их уникальность
-            if len(sequence) != len(options) or len(set(sequence)) != len(options):
-                await update.message.reply_text(
-                    f"Необходимо указать уникальные номера для всех {len(options)} вариантов."
-                )
-                return
-
-            for idx in sequence:
-                if idx < 0 or idx >= len(options):
-                    await update.message.reply_text(
-                        f"Указан неверный номер: {idx + 1}. Пожалуйста, выберите числа от 1 до {len(options)}."
-                    )
-                    return
-
-            # Преобразуем индексы в строки для единообразия с форматом хранения
-            sequence_str = [str(idx) for idx in sequence]
-
-            # Сохраняем правильную последовательность
-            context.user_data["correct_answer"] = sequence_str
-
-            # Запрашиваем объяснение
+        except ValueError:
             await update.message.reply_text(
-                "Введите объяснение правильного ответа (или отправьте 'Нет' для пропуска этого шага):"
+                "Пожалуйста, введите числа через запятую. Попробуйте еще раз."
             )
+            return
 
-            context.user_data["admin_state"] = "entering_explanation"
+        options = context.user_data.get("options", [])
 
-        except ValueError:
+        # Последовательность должна быть перестановкой номеров всех вариантов:
+        # сравнение множеств ловит и выход за диапазон, и повторы
+        if len(sequence) != len(options) or set(sequence) != set(range(len(options))):
             await update.message.reply_text(
-                "Пожалуйста, введите числа через запятую. Попробуйте еще раз."
+                f"Необходимо указать уникальные номера от 1 до {len(options)} для всех вариантов."
             )
+            return
+
+        # Преобразуем индексы в строки для единообразия с форматом хранения
+        sequence_str = [str(idx) for idx in sequence]
+
+        # Сохраняем правильную последовательность
+        context.user_data["correct_answer"] = sequence_str
+
+        # Запрашиваем объяснение
+        await update.message.reply_text(
+            "Введите объяснение правильного ответа (или отправьте 'Нет' для пропуска этого шага):"
+        )
+
+        context.user_data["admin_state"] = "entering_explanation"
 
     elif state == "entering_explanation":
         # Сохраняем объяснение, если оно не "Нет"
@@ -694,7 +745,7 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         }
 
         # Создаем новый вопрос
-        result = add_question_to_db(question_data)
+        result = await asyncio.to_thread(add_question_to_db, question_data)
 
         if result["success"]:
             await update.message.reply_text(
@@ -702,18 +753,9 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
             )
 
             # Спрашиваем, хочет ли администратор добавить еще один вопрос
-            keyboard = [
-                [
-                    InlineKeyboardButton("➕ Добавить еще вопрос", callback_data="admin_add_question"),
-                    InlineKeyboardButton("🔙 Вернуться в меню", callback_data="admin_back_main")
-                ]
-            ]
-
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
             await update.message.reply_text(
                 "Выберите дальнейшее действие:",
-                reply_markup=reply_markup
+                reply_markup=_AFTER_QUESTION_MARKUP
             )
         else:
             await update.message.reply_text(
@@ -740,7 +782,7 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         topic_description = '\n'.join(lines[1:]).strip() if len(lines) > 1 else None
 
         # Создаем новую тему
-        result = add_topic_to_db(topic_name, topic_description)
+        result = await asyncio.to_thread(add_topic_to_db, topic_name, topic_description)
 
         if result["success"]:
             await update.message.reply_text(
@@ -763,183 +805,289 @@ async def handle_admin_input(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
 
 
-def import_questions_from_json(data: dict) -> dict:
-    """Импорт вопросов из JSON"""
-    try:
-        # Проверяем структуру данных
-        if "topic" not in data or "questions" not in data:
-            return {"success": False, "message": "Неверная структура JSON. Должны быть поля 'topic' и 'questions'."}
+# Размер пачки новых вопросов для одной вставки при импорте
+IMPORT_FLUSH_EVERY = 500
 
-        topic_data = data["topic"]
-        questions_data = data["questions"]
 
-        with get_session() as session:
-            # Создаем или обновляем тему
-            topic = session.query(Topic).filter(Topic.id == topic_data.get("id")).first()
+def read_import_topic(fp) -> dict:
+    """Чтение объекта темы из бинарного JSON-потока импорта без разбора списка вопросов
 
-            if not topic:
-                # Если темы с таким ID нет, создаем новую
-                topic = Topic(
-                    name=topic_data["name"],
-                    description=topic_data.get("description", "")
-                )
-                session.add(topic)
-                session.flush()  # Чтобы получить ID
-            else:
-                # Если тема существует, обновляем её
-                topic.name = topic_data["name"]
-                topic.description = topic_data.get("description", topic.description)
-
-            # Добавляем вопросы
-            questions_count = 0
-            for q_data in questions_data:
-                # Проверяем, существует ли уже вопрос с таким ID в этой теме
-                question = session.query(Question).filter(
-                    Question.topic_id == topic.id,
-                    Question.id == q_data.get("id")
-                ).first()
-
-                if not question:
-                    # Создаем новый вопрос
-                    question = Question(
-                        topic_id=topic.id,
-                        text=q_data["text"],
-                        options=json.dumps(q_data["options"]),
-                        correct_answer=json.dumps(q_data["correct_answer"]),
-                        question_type=q_data["question_type"],
-                        difficulty=q_data.get("difficulty", 1),
-                        media_url=q_data.get("media_url"),
-                        explanation=q_data.get("explanation", "")
-                    )
-                    session.add(question)
-                else:
-                    # Обновляем существующий вопрос
-                    question.text = q_data["text"]
-                    question.options = json.dumps(q_data["options"])
-                    question.correct_answer = json.dumps(q_data["correct_answer"])
-                    question.question_type = q_data["question_type"]
-                    question.difficulty = q_data.get("difficulty", question.difficulty)
-                    question.media_url = q_data.get("media_url", question.media_url)
-                    question.explanation = q_data.get("explanation", question.explanation)
-
-                questions_count += 1
-
-            # Сохраняем изменения
-            session.commit()
-
-            return {
-                "success": True,
-                "topic_name": topic.name,
-                "questions_count": questions_count
-            }
+    Возвращает None, если в файле нет поля 'topic' или поле 'questions' не является списком.
+    """
+    fp.seek(0)
+    topic_data = next(ijson.items(fp, 'topic', use_float=True), None)
+    if topic_data is None:
+        return None
 
-    except Exception as e:
-        logger.error(f"Error in import_questions_from_json: {e}")
-        return {"success": False, "message": str(e)}
+    # Наличие списка вопросов проверяем по событию начала массива:
+    # разбор останавливается на нем, не читая сами вопросы
+    fp.seek(0)
+    has_questions = any(
+        prefix == 'questions' and event == 'start_array'
+        for prefix, event, _ in ijson.parse(fp)
+    )
+    return topic_data if has_questions else None
 
 
-def add_question_to_db(data: dict) -> dict:
-    """Добавление нового вопроса в базу данных"""
+def stream_import(fp):
+    """Потоковое чтение вопросов из бинарного JSON-потока импорта по одному"""
+    fp.seek(0)
+    yield from ijson.items(fp, 'questions.item', use_float=True)
+
+
+def import_questions_from_json_stream(fp) -> dict:
+    """Импорт вопросов из бинарного JSON-потока с постоянным расходом памяти
+
+    Вопросы читаются через ijson по одному и записываются пачками по
+    IMPORT_FLUSH_EVERY, поэтому файл целиком в память не загружается.
+    Вызов блокирующий: из обработчиков выполняется через asyncio.to_thread.
+    """
     try:
-        # Проверяем наличие необходимых полей
-        required_fields = ["topic_id", "text", "options", "correct_answer", "question_type"]
-        for field in required_fields:
-            if field not in data or data[field] is None:
-                return {"success": False, "message": f"Отсутствует обязательное поле: {field}"}
-
-        with get_session() as session:
-            # Проверяем существование темы
-            topic = session.query(Topic).get(data["topic_id"])
-            if not topic:
-                return {"success": False, "message": "Указанная тема не существует"}
-
-            # Создаем новый вопрос
-            question = Question(
-                topic_id=data["topic_id"],
-                text=data["text"],
-                options=json.dumps(data["options"]),
-                correct_answer=json.dumps(data["correct_answer"]),
-                question_type=data["question_type"],
-                difficulty=data.get("difficulty", 1),
-                media_url=data.get("media_url"),
-                explanation=data.get("explanation", "")
-            )
+        topic_data = read_import_topic(fp)
+        if topic_data is None:
+            return {"success": False, "message": "Неверная структура JSON. Должны быть поля 'topic' и 'questions'."}
+        return import_questions_stream(topic_data, stream_import(fp))
+    except ijson.JSONError as e:
+        return {"success": False, "message": f"Файл не является корректным JSON: {e}"}
+    except KeyError as e:
+        return {"success": False, "message": f"В вопросе отсутствует обязательное поле: {e}"}
+
 
-            session.add(question)
-            session.commit()
+def import_questions_from_json(data: dict) -> dict:
+    """Импорт вопросов из JSON"""
+    # Проверяем структуру данных
+    if "topic" not in data or "questions" not in data:
+        return {"success": False, "message": "Неверная структура JSON. Должны быть поля 'topic' и 'questions'."}
 
-            return {"success": True, "question_id": question.id}
+    return import_questions_stream(data["topic"], data["questions"])
 
-    except Exception as e:
-        logger.error(f"Error in add_question_to_db: {e}")
-        return {"success": False, "message": str(e)}
 
+def _invalidates_topic_cache(func):
+    """Сброс кэша тем и статистики по темам после успешной операции записи
 
-def add_topic_to_db(name: str, description: str = None) -> dict:
-    """Добавление новой темы в базу данных"""
-    try:
-        # Проверяем название
-        if not name or len(name.strip()) < 3:
-            return {"success": False, "message": "Название темы должно содержать минимум 3 символа"}
+    Применяется поверх @transactional, поэтому кэш сбрасывается уже после commit:
+    иначе параллельный запрос мог бы заполнить его данными до фиксации транзакции.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        result = func(*args, **kwargs)
+        if result.get("success"):
+            topic_cache.invalidate()
+            _invalidate_topic_analytics()
+        return result
+    return wrapper
 
-        with get_session() as session:
-            # Проверяем уникальность названия
-            existing_topic = session.query(Topic).filter(Topic.name == name).first()
-            if existing_topic:
-                return {"success": False, "message": f"Тема с названием '{name}' уже существует"}
 
-            # Создаем новую тему
+@_invalidates_topic_cache
+@transactional
+def import_questions_stream(session, topic_data: dict, questions_iter) -> dict:
+    """Импорт вопросов темы из итератора словарей вопросов"""
+    try:
+        # Создаем или обновляем тему
+        topic_id = topic_data.get("id")
+        topic = session.get(Topic, topic_id) if topic_id is not None else None
+        if not topic:
+            # Повторный импорт файла без ID темы дополняет уже существующую тему
+            # с тем же названием. В старых базах без уникального индекса названия
+            # могут повторяться: тогда тему нельзя выбрать однозначно
+            same_name = session.query(Topic).filter(Topic.name == topic_data["name"]).limit(2).all()
+            if len(same_name) > 1:
+                return {
+                    "success": False,
+                    "message": f"Найдено несколько тем с названием '{topic_data['name']}'. Укажите ID темы в файле"
+                }
+            topic = same_name[0] if same_name else None
+
+        if not topic:
+            # Если темы с таким ID нет, создаем новую
             topic = Topic(
-                name=name,
-                description=description
+                name=topic_data["name"],
+                description=topic_data.get("description", "")
             )
-
             session.add(topic)
-            session.commit()
+            session.flush()  # Чтобы получить ID
+        else:
+            # Если тема существует, обновляем её
+            topic.name = topic_data["name"]
+            topic.description = topic_data.get("description", topic.description)
+
+        # ID уже существующих вопросов темы загружаем одним запросом
+        # вместо поиска каждого вопроса по отдельности
+        existing_ids = {
+            question_id for (question_id,) in
+            session.query(Question.id).filter(Question.topic_id == topic.id).all()
+        }
+
+        # Новые и изменяемые вопросы копятся пачками и записываются одним
+        # пакетным INSERT / UPDATE по первичному ключу (executemany) на пачку.
+        # Автоматический flush в сессиях отключен, поэтому в цикле нет
+        # промежуточных запросов, и все пачки фиксируются одним commit
+        questions_count = 0
+        new_rows = []
+        update_rows = []
+        for q_data in questions_iter:
+            question_id = q_data.get("id")
+
+            if question_id not in existing_ids:
+                # Создаем новый вопрос
+                new_rows.append({
+                    "topic_id": topic.id,
+                    "text": q_data["text"],
+                    "options": q_data["options"],
+                    "correct_answer": q_data["correct_answer"],
+                    "question_type": q_data["question_type"],
+                    "difficulty": q_data.get("difficulty", 1),
+                    "media_url": q_data.get("media_url"),
+                    "explanation": q_data.get("explanation", "")
+                })
+                if len(new_rows) >= IMPORT_FLUSH_EVERY:
+                    session.execute(insert(Question), new_rows)
+                    new_rows = []
+            else:
+                # Обновляем существующий вопрос; необязательные поля,
+                # отсутствующие в файле, сохраняют текущие значения
+                row = {
+                    "id": question_id,
+                    "text": q_data["text"],
+                    "options": q_data["options"],
+                    "correct_answer": q_data["correct_answer"],
+                    "question_type": q_data["question_type"]
+                }
+                for field in ("difficulty", "media_url", "explanation"):
+                    if field in q_data:
+                        row[field] = q_data[field]
+                update_rows.append(row)
+                if len(update_rows) >= IMPORT_FLUSH_EVERY:
+                    session.execute(sql_update(Question), update_rows)
+                    update_rows = []
+
+            questions_count += 1
+
+        if new_rows:
+            session.execute(insert(Question), new_rows)
+        if update_rows:
+            session.execute(sql_update(Question), update_rows)
+
+        # Изменения темы записываем здесь, чтобы конфликт названий попал в обработчик ниже
+        session.flush()
+    except IntegrityError as e:
+        session.rollback()
+        logger.error(f"Integrity error in import_questions_stream: {e}")
+        return {"success": False, "message": f"Конфликт данных при импорте (повторяющиеся или неверные ID): {e.orig}"}
+
+    return {
+        "success": True,
+        "topic_name": topic.name,
+        "questions_count": questions_count
+    }
+
+
+@_invalidates_topic_cache
+@transactional
+def add_question_to_db(session, data: dict) -> dict:
+    """Добавление нового вопроса в базу данных"""
+    # Проверяем наличие необходимых полей
+    required_fields = ["topic_id", "text", "options", "correct_answer", "question_type"]
+    for field in required_fields:
+        if field not in data or data[field] is None:
+            return {"success": False, "message": f"Отсутствует обязательное поле: {field}"}
+
+    # Проверяем существование темы
+    topic = session.get(Topic, data["topic_id"])
+    if not topic:
+        return {"success": False, "message": "Указанная тема не существует"}
+
+    # Создаем новый вопрос
+    question = Question(
+        topic_id=data["topic_id"],
+        text=data["text"],
+        options=data["options"],
+        correct_answer=data["correct_answer"],
+        question_type=data["question_type"],
+        difficulty=data.get("difficulty", 1),
+        media_url=data.get("media_url"),
+        explanation=data.get("explanation", "")
+    )
 
-            return {"success": True, "topic_id": topic.id}
+    session.add(question)
+    session.flush()  # Чтобы получить ID
 
-    except Exception as e:
-        logger.error(f"Error in add_topic_to_db: {e}")
-        return {"success": False, "message": str(e)}
+    return {"success": True, "question_id": question.id}
+
+
+@_invalidates_topic_cache
+@transactional
+def add_topic_to_db(session, name: str, description: str = None) -> dict:
+    """Добавление новой темы в базу данных"""
+    # Проверяем название
+    if not name or len(name.strip()) < 3:
+        return {"success": False, "message": "Название темы должно содержать минимум 3 символа"}
+
+    # Проверяем, существует ли тема с таким названием. В базах с уникальным индексом
+    # гонку между проверкой и вставкой дополнительно ловит IntegrityError ниже;
+    # в старых базах, где индекс не удалось создать, остается только эта проверка
+    if session.query(Topic.id).filter(Topic.name == name).first():
+        return {"success": False, "message": f"Тема с названием '{name}' уже существует"}
+
+    topic = Topic(
+        name=name,
+        description=description
+    )
+
+    try:
+        session.add(topic)
+        session.flush()  # Чтобы получить ID
+    except IntegrityError:
+        session.rollback()
+        return {"success": False, "message": f"Тема с названием '{name}' уже существует"}
+
+    return {"success": True, "topic_id": topic.id}
 
 
 async def show_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показ панели администратора"""
     query = update.callback_query
 
-    # Создаем клавиатуру админ-панели
-    keyboard = [
-        [
-            InlineKeyboardButton("📊 Статистика по темам", callback_data="admin_topic_stats"),
-            InlineKeyboardButton("👥 Пользователи", callback_data="admin_users")
-        ],
-        [
-            InlineKeyboardButton("➕ Добавить вопрос", callback_data="admin_add_question"),
-            InlineKeyboardButton("📁 Импорт вопросов", callback_data="admin_import")
-        ],
-        [
-            InlineKeyboardButton("✏️ Редактировать темы", callback_data="admin_edit_topics"),
-            InlineKeyboardButton("⚙️ Настройки бота", callback_data="admin_settings")
-        ]
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     await query.edit_message_text(
         "👨‍💻 *Панель администратора*\n\n"
         "Выберите действие из списка ниже:",
-        reply_markup=reply_markup,
+        reply_markup=_ADMIN_MAIN_MARKUP,
         parse_mode="Markdown"
     )
 
 
+def _cached_topic_analytics() -> dict:
+    """Статистика по темам из кэша; при промахе строится заново, ошибки не кэшируются"""
+    with _stats_cache_lock:
+        cached = _stats_cache.get("topics")
+    if cached is None:
+        stats = generate_topic_analytics()
+        if not stats["success"]:
+            return stats
+        cached = dict(stats)
+        if "chart" in cached:
+            cached["chart"] = cached["chart"].getvalue()
+        with _stats_cache_lock:
+            _stats_cache["topics"] = cached
+
+    stats = dict(cached)
+    if "chart" in stats:
+        stats["chart"] = io.BytesIO(stats["chart"])
+    return stats
+
+
+def _invalidate_topic_analytics() -> None:
+    """Сброс кэша статистики после изменения тем или вопросов"""
+    with _stats_cache_lock:
+        _stats_cache.clear()
+
+
 async def show_topic_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показ статистики по темам"""
     query = update.callback_query
 
-    # Получаем статистику по темам
-    stats = generate_topic_analytics()
+    # Получаем статистику по темам (повторные просмотры берутся из кэша)
+    stats = await asyncio.to_thread(_cached_topic_analytics)
 
     if not stats["success"]:
         await query.edit_message_text(
@@ -957,27 +1105,21 @@ async def show_topic_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 
     try:
         # Форматируем текст со статистикой
-        stats_text = "📊 *Статистика по темам*\n\n"
+        parts = ["📊 *Статистика по темам*\n\n"]
 
         # Добавляем информацию о самых сложных и простых темах
         topic_stats = stats["topic_stats"]
-        stats_text += "*Сложность тем (от самой сложной к самой простой):*\n"
+        parts.append("*Сложность тем (от самой сложной к самой простой):*\n")
 
         for i, topic in enumerate(topic_stats):
             emoji = "🔴" if i < 2 else "🟡" if i < len(topic_stats) - 2 else "🟢"
-            stats_text += f"{emoji} {topic['topic_name']}: {topic['avg_score']}% (пройдено тестов: {topic['tests_count']})\n"
-
-        # Кнопка для возврата
-        keyboard = [
-            [InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")]
-        ]
+            parts.append(f"{emoji} {topic['topic_name']}: {topic['avg_score']}% (пройдено тестов: {topic['tests_count']})\n")
+        stats_text = "".join(parts)
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        # Отправляем текст статистики
+        # Отправляем текст статистики с кнопкой возврата
         await query.edit_message_text(
             stats_text,
-            reply_markup=reply_markup,
+            reply_markup=_BACK_TO_MAIN_MARKUP,
             parse_mode="Markdown"
         )
 
@@ -996,58 +1138,59 @@ async def show_topic_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         )
 
 
+def _count_users_by_role() -> dict:
+    """Количество пользователей по ролям одним запросом с группировкой"""
+    with get_session() as session:
+        return dict(
+            session.query(User.role, func.count(User.id)).group_by(User.role).all()
+        )
+
+
+def _fetch_recent_users(limit: int = 10) -> list:
+    """Последние активные пользователи: только нужные колонки, строки не привязаны к сессии"""
+    with get_session() as session:
+        return (
+            session.query(User.role, User.full_name, User.username, User.telegram_id, User.last_active)
+            .order_by(User.last_active.desc())
+            .limit(limit)
+            .all()
+        )
+
+
 async def show_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показ списка пользователей"""
     query = update.callback_query
 
     try:
-        with get_session() as session:
-            # Получаем статистику по пользователям
-            students_count = session.query(User).filter(User.role == "student").count()
-            parents_count = session.query(User).filter(User.role == "parent").count()
-            admins_count = session.query(User).filter(User.role == "admin").count()
-
-            # Получаем список последних активных пользователей
-            # Важно: создаем копии данных, а не используем объекты сессии напрямую
-            recent_users = []
-            for user in session.query(User).order_by(User.last_active.desc()).limit(10).all():
-                recent_users.append({
-                    "role": user.role,
-                    "full_name": user.full_name,
-                    "username": user.username,
-                    "telegram_id": user.telegram_id,
-                    "last_active": user.last_active
-                })
+        # Оба запроса независимы: выполняем их параллельно в рабочих потоках,
+        # каждый в своей сессии, не блокируя event loop
+        role_counts, recent_users = await asyncio.gather(
+            asyncio.to_thread(_count_users_by_role),
+            asyncio.to_thread(_fetch_recent_users)
+        )
+        students_count = role_counts.get("student", 0)
+        parents_count = role_counts.get("parent", 0)
+        admins_count = role_counts.get("admin", 0)
 
         # Форматируем текст со статистикой
-        users_text = "👥 *Статистика пользователей*\n\n"
-        users_text += f"• Всего учеников: {students_count}\n"
-        users_text += f"• Всего родителей: {parents_count}\n"
-        users_text += f"• Всего администраторов: {admins_count}\n\n"
-
-        users_text += "*Недавняя активность:*\n"
-        for user_data in recent_users:
-            role_emoji = "👨‍🎓" if user_data["role"] == "student" else "👨‍👩‍👧‍👦" if user_data["role"] == "parent" else "👨‍💻"
-            name = user_data["full_name"] or user_data["username"] or f"Пользователь {user_data['telegram_id']}"
-            last_active = user_data["last_active"].strftime('%d.%m.%Y %H:%M')
-            users_text += f"{role_emoji} {name} - {last_active}\n"
-
-        # Кнопки для действий с пользователями и возврата
-        keyboard = [
-            [
-                InlineKeyboardButton("👨‍🎓 Ученики", callback_data="admin_list_students"),
-                InlineKeyboardButton("👨‍👩‍👧‍👦 Родители", callback_data="admin_list_parents")
-            ],
-            [
-                InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
-            ]
+        parts = [
+            "👥 *Статистика пользователей*\n\n",
+            f"• Всего учеников: {students_count}\n",
+            f"• Всего родителей: {parents_count}\n",
+            f"• Всего администраторов: {admins_count}\n\n",
+            "*Недавняя активность:*\n"
         ]
+        fmt = "%d.%m.%Y %H:%M"
+        for user_row in recent_users:
+            role_emoji = _ROLE_EMOJI.get(user_row.role, "👨‍💻")
+            name = user_row.full_name or user_row.username or f"Пользователь {user_row.telegram_id}"
+            parts.append(f"{role_emoji} {name} - {user_row.last_active.strftime(fmt)}\n")
+        users_text = "".join(parts)
 
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
+        # Кнопки для действий с пользователями и возврата
         await query.edit_message_text(
             users_text,
-            reply_markup=reply_markup,
+            reply_markup=_USERS_MARKUP,
             parse_mode="Markdown"
         )
     except Exception as e:
@@ -1063,26 +1206,26 @@ async def show_topics_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     query = update.callback_query
 
     try:
-        with get_session() as session:
-            # Получаем список тем с созданием копии данных
-            topics_data = []
-            for topic in session.query(Topic).all():
-                topics_data.append({
-                    "id": topic.id,
-                    "name": topic.name,
-                    "description": topic.description
-                })
+        topics, question_counts = await asyncio.gather(
+            asyncio.to_thread(topic_cache.get_topics_cached),
+            asyncio.to_thread(topic_cache.get_question_counts)
+        )
+        topics_data = [
+            {"id": topic_id, "name": name, "description": description}
+            for topic_id, name, description in topics
+        ]
 
         # Форматируем текст со списком тем
-        topics_text = "✏️ *Темы для тестирования*\n\n"
+        parts = ["✏️ *Темы для тестирования*\n\n"]
 
         if not topics_data:
-            topics_text += "Список тем пуст. Создайте первую тему."
+            parts.append("Список тем пуст. Создайте первую тему.")
         else:
             for topic in topics_data:
-                topics_text += f"• *{topic['name']}*\n"
+                parts.append(f"• *{topic['name']}* ({question_counts.get(topic['id'], 0)} вопр.)\n")
                 if topic['description']:
-                    topics_text += f"  _{topic['description']}_\n"
+                    parts.append(f"  _{topic['description']}_\n")
+        topics_text = "".join(parts)
 
         # Кнопки для добавления темы и возврата
         keyboard = [
@@ -1121,8 +1264,6 @@ async def show_bot_settings(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Показ настроек бота"""
     query = update.callback_query
 
-    from config import DEFAULT_QUESTIONS_COUNT, ENABLE_PARENT_REPORTS
-
     # Форматируем текст с настройками
     settings_text = "⚙️ *Настройки бота*\n\n"
     settings_text += "Здесь вы можете настроить общие параметры работы бота:\n\n"
@@ -1133,28 +1274,42 @@ async def show_bot_settings(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     settings_text += "Выберите настройку для изменения:"
 
-    # Кнопки для изменения настроек и возврата
-    keyboard = [
-        [
-            InlineKeyboardButton("🔢 Число вопросов", callback_data="admin_setting_questions_count"),
-            InlineKeyboardButton("📊 Отчеты родителям", callback_data="admin_setting_reports")
-        ],
-        [
-            InlineKeyboardButton("🔙 Назад", callback_data="admin_back_main")
-        ]
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
     if query:
         await query.edit_message_text(
             settings_text,
-            reply_markup=reply_markup,
+            reply_markup=_BOT_SETTINGS_MARKUP,
             parse_mode="Markdown"
         )
     else:
         await update.message.reply_text(
             settings_text,
-            reply_markup=reply_markup,
+            reply_markup=_BOT_SETTINGS_MARKUP,
             parse_mode="Markdown"
-        )
\ No newline at end of file
+        )
+
+
+# Таблицы маршрутизации кнопок панели администратора. Объявлены в конце модуля,
+# так как ссылаются на обработчики, определенные выше
+_EXACT = {
+    "admin_topic_stats": show_topic_stats,
+    "admin_users": show_users_list,
+    "admin_add_question": _on_add_question,
+    "admin_import": _on_import,
+    "admin_edit_topics": show_topics_list,
+    "admin_settings": show_bot_settings,
+    "admin_setting_questions_count": _on_questions_count_menu,
+    "admin_setting_reports": _on_reports_menu,
+    "admin_back_main": show_admin_panel,
+    "admin_back_topics": _on_back_topics,
+    "admin_back_topics_list": show_topics_list,
+}
+
+# Обработчики кнопок с параметром: ключ - действие из _CB_RE, параметр передается отдельно
+_PREFIX = {
+    "set_questions": _on_set_questions_count,
+    "reports": _on_set_reports,
+    "select_topic": _on_select_topic,
+    "question_type": _on_question_type,
+    "add_topic": _on_add_topic,
+    "edit_topic": _on_edit_topic,
+}
\ No newline at end of file
@@ -1,70 +1,226 @@
 import logging
-import traceback
 import asyncio
 import json
 from datetime import datetime
+from cachetools import TTLCache
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import TelegramError
 from telegram.ext import ContextTypes
+from sqlalchemy import bindparam, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy import update as sql_update  # Имя update занято аргументом обработчиков
 
 from database.models import User
-from database.db_manager import get_session
+from database.db_manager import engine, get_session, get_user_role, peek_user_role, invalidate_user
 from services.stats_service import get_user_stats, generate_leaderboard
 
 logger = logging.getLogger(__name__)
 
+# Отложенные обновления last_active: telegram_id -> время последнего нажатия кнопки.
+# Точность до нескольких секунд не нужна, поэтому вместо commit на каждое нажатие
+# отметки записываются одним UPDATE раз в ACTIVE_FLUSH_INTERVAL секунд
+ACTIVE_FLUSH_INTERVAL = 5
+_pending_active: dict[int, datetime] = {}
+
+# INSERT с поддержкой ON CONFLICT для используемой СУБД (PostgreSQL или SQLite)
+_dialect_insert = pg_insert if engine.dialect.name == "postgresql" else sqlite_insert
+
+# Таблица лидеров одинакова для всех пользователей: результат агрегирующего
+# запроса переиспользуется в течение LEADERBOARD_TTL секунд
+LEADERBOARD_TTL = 30
+_leaderboard_cache = TTLCache(maxsize=8, ttl=LEADERBOARD_TTL)
+
+# Названия периодов таблицы лидеров в винительном падеже ("за неделю")
+_PERIOD_NAMES = {
+    "week": "неделю",
+    "month": "месяц",
+    "year": "год",
+    "all": "всё время"
+}
+
+# Неизменяемые клавиатуры создаются один раз при загрузке модуля
+_STUDENT_MENU_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("📝 Начать тест", callback_data="common_start_test"),
+        InlineKeyboardButton("📊 Моя статистика", callback_data="common_stats")
+    ],
+    [
+        InlineKeyboardButton("🏆 Достижения", callback_data="common_achievements"),
+        InlineKeyboardButton("🔍 Справка", callback_data="common_help")
+    ]
+])
+
+_PARENT_MENU_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("🔗 Привязать ученика", callback_data="common_link_student"),
+        InlineKeyboardButton("📊 Отчеты", callback_data="common_reports")
+    ],
+    [
+        InlineKeyboardButton("⚙️ Настройки", callback_data="common_parent_settings"),
+        InlineKeyboardButton("🔍 Справка", callback_data="common_help")
+    ]
+])
+
+# Кнопки выбора периода таблицы лидеров
+_LEADERBOARD_PERIOD_MARKUP = InlineKeyboardMarkup([
+    [
+        InlineKeyboardButton("За неделю", callback_data="common_leaderboard_week"),
+        InlineKeyboardButton("За месяц", callback_data="common_leaderboard_month")
+    ],
+    [
+        InlineKeyboardButton("За год", callback_data="common_leaderboard_year"),
+        InlineKeyboardButton("За всё время", callback_data="common_leaderboard_all")
+    ],
+    [
+        InlineKeyboardButton("🔙 Назад", callback_data="common_stats")
+    ]
+])
+
+
+def _save_user(user_id: int, username: str, full_name: str, role: str) -> bool:
+    """Синхронное создание или обновление пользователя (выполняется в рабочем потоке)
+
+    Один INSERT ... ON CONFLICT DO UPDATE вместо SELECT с последующим INSERT/UPDATE:
+    один запрос к БД и нет гонки двух одновременных /start одного пользователя
+    """
+    now = datetime.utcnow()
+    stmt = _dialect_insert(User).values(
+        telegram_id=user_id,
+        username=username,
+        full_name=full_name,
+        role=role,
+        created_at=now,
+        last_active=now
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.telegram_id],
+        set_={
+            "username": stmt.excluded.username,
+            "full_name": stmt.excluded.full_name,
+            "role": stmt.excluded.role,
+            "last_active": stmt.excluded.last_active,
+            # Пустые настройки заменяются значением по умолчанию ({})
+            "settings": func.coalesce(User.settings, stmt.excluded.settings),
+        }
+    )
+
+    with get_session() as session:
+        session.execute(stmt)
+        session.commit()
+    invalidate_user(user_id)
+
+    logger.info(f"Сохранен пользователь: telegram_id={user_id}, роль={role}")
+    return True
+
 
 async def check_and_create_user(user_id: int, username: str, full_name: str, role: str) -> bool:
     """Проверка и создание пользователя, если он не существует"""
     try:
-        from database.models import User
-        from database.db_manager import get_session
-
-        with get_session() as session:
-            # Проверяем существование пользователя
-            existing_user = session.query(User).filter(User.telegram_id == user_id).first()
-
-            if existing_user:
-                # Обновляем существующего пользователя
-                existing_user.username = username
-                existing_user.full_name = full_name
-                existing_user.role = role
-                existing_user.last_active = datetime.utcnow()
-                if not existing_user.settings:
-                    existing_user.settings = '{}'
-
-                logger.info(f"Обновлен пользователь: id={existing_user.id}, роль={role}")
-                session.commit()
-                return True
-            else:
-                # Создаем нового пользователя
-                new_user = User(
-                    telegram_id=user_id,
-                    username=username,
-                    full_name=full_name,
-                    role=role,
-                    created_at=datetime.utcnow(),
-                    last_active=datetime.utcnow(),
-                    settings='{}' if role == 'parent' else None
-                )
-
-                session.add(new_user)
-                session.commit()
-
-                # Проверяем создание
-                check_user = session.query(User).filter(User.telegram_id == user_id).first()
-                if check_user:
-                    logger.info(f"Создан новый пользователь: id={check_user.id}, роль={role}")
-                    return True
-                else:
-                    logger.error(f"Не удалось создать пользователя с telegram_id={user_id}")
-                    return False
+        # Синхронная работа с БД выполняется в отдельном потоке, чтобы не блокировать event loop
+        return await asyncio.to_thread(_save_user, user_id, username, full_name, role)
 
-    except Exception as e:
-        logger.error(f"Ошибка при проверке/создании пользователя: {e}")
-        logger.error(traceback.format_exc())
+    except SQLAlchemyError:
+        logger.exception("Ошибка при проверке/создании пользователя")
         return False
 
 
+def _write_last_active(pending: dict) -> None:
+    """Запись накопленных отметок активности одним пакетным UPDATE (executemany)"""
+    users = User.__table__
+    with get_session() as session:
+        session.execute(
+            sql_update(users)
+            .where(users.c.telegram_id == bindparam("tg_id"))
+            .values(last_active=bindparam("ts")),
+            [{"tg_id": tg_id, "ts": ts} for tg_id, ts in pending.items()]
+        )
+        session.commit()
+
+
+async def flush_last_active() -> None:
+    """Запись накопленных отметок активности в БД"""
+    if not _pending_active:
+        return
+
+    # Словарь изменяется только в event loop, поэтому копирование и очистка атомарны
+    pending = dict(_pending_active)
+    _pending_active.clear()
+    try:
+        await asyncio.to_thread(_write_last_active, pending)
+    except Exception as e:
+        logger.error(f"Ошибка при записи времени активности пользователей: {e}")
+
+
+async def flush_last_active_loop() -> None:
+    """Фоновая задача: раз в ACTIVE_FLUSH_INTERVAL секунд записывает отметки активности"""
+    while True:
+        await asyncio.sleep(ACTIVE_FLUSH_INTERVAL)
+        await flush_last_active()
+
+
+# Таблица маршрутизации кнопок меню: callback_data -> (обработчик, удалять ли
+# сообщение, очищать ли context.args). Заполняется _resolve_handlers() при старте бота
+_DISPATCH: dict = {}
+
+
+def _resolve_handlers() -> None:
+    """Заполнение таблицы маршрутизации после загрузки всех модулей обработчиков.
+
+    Импорты вынесены сюда из-за циклических зависимостей между модулями handlers;
+    вызывается один раз из bot.py, а не при каждом нажатии кнопки.
+    """
+    from handlers.parent import get_report, settings
+    from handlers.admin import admin_panel
+    from handlers.student import start_test, show_stats, show_achievements
+    from handlers.start import help_command
+
+    _DISPATCH.update({
+        "common_reports": (get_report, True, True),
+        "common_parent_settings": (settings, True, True),
+        "common_admin_panel": (admin_panel, True, False),
+        "common_start_test": (start_test, True, False),
+        "common_stats": (show_stats, True, False),
+        "common_achievements": (show_achievements, True, False),
+        "common_help": (help_command, True, False),
+        "common_leaderboard": (show_leaderboard, False, False),
+    })
+
+
+async def _register_role(update: Update, context: ContextTypes.DEFAULT_TYPE, role: str,
+                         success_text: str, markup: InlineKeyboardMarkup) -> None:
+    """Регистрация пользователя с выбранной ролью и отправка главного меню"""
+    query = update.callback_query
+    telegram_user = update.effective_user
+    logger.info(f"Начало регистрации пользователя {telegram_user.id} с ролью {role}")
+    full_name = f"{telegram_user.first_name} {telegram_user.last_name or ''}"
+
+    # Создаем или обновляем пользователя (ошибки БД логируются внутри)
+    success = await check_and_create_user(
+        user_id=telegram_user.id,
+        username=telegram_user.username,
+        full_name=full_name,
+        role=role
+    )
+
+    if not success:
+        await query.edit_message_text(
+            "Произошла ошибка при регистрации. Пожалуйста, попробуйте еще раз или обратитесь к администратору."
+        )
+        return
+
+    # Подтверждение регистрации и главное меню отправляем параллельно
+    await asyncio.gather(
+        query.edit_message_text(success_text),
+        context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="Выберите действие:",
+            reply_markup=markup
+        )
+    )
+
+
 async def handle_common_button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик нажатий на общие кнопки интерфейса"""
     query = update.callback_query
@@ -75,185 +231,58 @@ async def handle_common_button(update: Update, context: ContextTypes.DEFAULT_TYP
 
     # Если это выбор роли, обрабатываем особым образом
     if query.data == "common_role_student":
-        logger.info(f"Начало регистрации пользователя {user_id} как ученика")
-        try:
-            telegram_user = update.effective_user
-            full_name = f"{telegram_user.first_name} {telegram_user.last_name or ''}"
-
-            # Создаем или обновляем пользователя
-            success = await check_and_create_user(
-                user_id=user_id,
-                username=telegram_user.username,
-                full_name=full_name,
-                role="student"
-            )
-
-            if not success:
-                raise Exception("Не удалось создать/обновить пользователя")
-
-            # Отправляем сообщение о успешной регистрации
-            await query.edit_message_text(
-                "✅ Вы успешно зарегистрированы как ученик!\n\n"
-                "Вы можете проходить тесты, отслеживать свою успеваемость и получать достижения."
-            )
+        await _register_role(
+            update, context, "student",
+            "✅ Вы успешно зарегистрированы как ученик!\n\n"
+            "Вы можете проходить тесты, отслеживать свою успеваемость и получать достижения.",
+            _STUDENT_MENU_MARKUP
+        )
+        return
+    elif query.data == "common_role_parent":
+        await _register_role(
+            update, context, "parent",
+            "✅ Вы успешно зарегистрированы как родитель!\n\n"
+            "Вы можете привязать аккаунт ученика, используя команду /link с кодом, который вам предоставит ученик.",
+            _PARENT_MENU_MARKUP
+        )
+        return
 
-            # Небольшая пауза перед отображением меню
-            await asyncio.sleep(1)
-
-            # Отправляем главное меню
-            student_keyboard = [
-                [
-                    InlineKeyboardButton("📝 Начать тест", callback_data="common_start_test"),
-                    InlineKeyboardButton("📊 Моя статистика", callback_data="common_stats")
-                ],
-                [
-                    InlineKeyboardButton("🏆 Достижения", callback_data="common_achievements"),
-                    InlineKeyboardButton("🔍 Справка", callback_data="common_help")
-                ]
-            ]
-            student_markup = InlineKeyboardMarkup(student_keyboard)
-
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="Выберите действие:",
-                reply_markup=student_markup
-            )
-            return
-        except Exception as e:
-            logger.error(f"Ошибка при регистрации ученика: {e}")
-            logger.error(traceback.format_exc())
+    # Для других кнопок проверяем, зарегистрирован ли пользователь
+    try:
+        # Роль берем из общего кэша пользователей; к БД обращаемся только при промахе
+        role = peek_user_role(user_id)
+        if role is None:
+            role = await asyncio.to_thread(get_user_role, user_id)
+        if role is None:
+            logger.warning(f"Пользователь {user_id} не найден в базе при нажатии на кнопку {query.data}")
             await query.edit_message_text(
-                "Произошла ошибка при регистрации. Пожалуйста, попробуйте еще раз или обратитесь к администратору."
+                "Кажется, вы еще не зарегистрированы. Пожалуйста, используйте команду /start"
             )
             return
-    elif query.data == "common_role_parent":
-        logger.info(f"Начало регистрации пользователя {user_id} как родителя")
-        try:
-            telegram_user = update.effective_user
-            full_name = f"{telegram_user.first_name} {telegram_user.last_name or ''}"
-
-            # Создаем или обновляем пользователя
-            success = await check_and_create_user(
-                user_id=user_id,
-                username=telegram_user.username,
-                full_name=full_name,
-                role="parent"
-            )
 
-            if not success:
-                raise Exception("Не удалось создать/обновить пользователя")
+        # Время последней активности запоминаем в памяти; в БД оно попадает
+        # пакетом из flush_last_active_loop
+        _pending_active[user_id] = datetime.utcnow()
 
-            # Отправляем сообщение о успешной регистрации
-            await query.edit_message_text(
-                "✅ Вы успешно зарегистрированы как родитель!\n\n"
-                "Вы можете привязать аккаунт ученика, используя команду /link с кодом, который вам предоставит ученик."
-            )
+        logger.info(f"Роль пользователя {user_id}: {role}")
 
-            # Небольшая пауза перед отображением меню
-            await asyncio.sleep(1)
-
-            # Отправляем главное меню
-            parent_keyboard = [
-                [
-                    InlineKeyboardButton("🔗 Привязать ученика", callback_data="common_link_student"),
-                    InlineKeyboardButton("📊 Отчеты", callback_data="common_reports")
-                ],
-                [
-                    InlineKeyboardButton("⚙️ Настройки", callback_data="common_parent_settings"),
-                    InlineKeyboardButton("🔍 Справка", callback_data="common_help")
-                ]
-            ]
-            parent_markup = InlineKeyboardMarkup(parent_keyboard)
-
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="Выберите действие:",
-                reply_markup=parent_markup
-            )
-            return
-        except Exception as e:
-            logger.error(f"Ошибка при регистрации родителя: {e}")
-            logger.error(traceback.format_exc())
-            await query.edit_message_text(
-                "Произошла ошибка при регистрации. Пожалуйста, попробуйте еще раз или обратитесь к администратору."
-            )
-            return
+        # Кнопки меню: один поиск в таблице вместо цепочки сравнений
+        entry = _DISPATCH.get(query.data)
+        if entry is not None:
+            handler, delete_first, clear_args = entry
+            if delete_first:
+                await query.delete_message()
+            if clear_args:
+                context.args = []  # Пустой список аргументов для команды
+            await handler(update, context)
 
-    # Для других кнопок проверяем, зарегистрирован ли пользователь
-    try:
-        # Получаем роль пользователя
-        with get_session() as session:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                logger.warning(f"Пользователь {user_id} не найден в базе при нажатии на кнопку {query.data}")
-                await query.edit_message_text(
-                    "Кажется, вы еще не зарегистрированы. Пожалуйста, используйте команду /start"
-                )
-                return
-
-            # Обновляем время последней активности
-            user.last_active = datetime.utcnow()
-            session.commit()
-
-            role = user.role
-            logger.info(f"Роль пользователя {user_id}: {role}")
-
-        # Обработка кнопок выбора роли (для новых пользователей)
-        if query.data == "common_link_student":
+        elif query.data == "common_link_student":
             await query.edit_message_text(
                 "Для привязки аккаунта ученика используйте команду /link с кодом ученика.\n\n"
                 "Пример: /link 123456\n\n"
                 "Код можно получить у ученика, который должен выполнить команду /mycode"
             )
 
-        elif query.data == "common_reports":
-            await query.delete_message()
-            context.args = []  # Пустой список аргументов для команды
-            # Импортируем функцию здесь, чтобы избежать циклических импортов
-            from handlers.parent import get_report
-            await get_report(update, context)
-
-        elif query.data == "common_parent_settings":
-            await query.delete_message()
-            context.args = []  # Пустой список аргументов для команды
-            # Импортируем функцию здесь, чтобы избежать циклических импортов
-            from handlers.parent import settings
-            await settings(update, context)
-
-        elif query.data == "common_admin_panel":
-            await query.delete_message()
-            # Импортируем функцию здесь, чтобы избежать циклических импортов
-            from handlers.admin import admin_panel
-            await admin_panel(update, context)
-
-        # Обработка общих кнопок меню
-        elif query.data == "common_start_test":
-            await query.delete_message()
-            # Импортируем функцию здесь, чтобы избежать циклических импортов
-            from handlers.student import start_test
-            await start_test(update, context)
-
-        elif query.data == "common_stats":
-            await query.delete_message()
-            # Импортируем функцию здесь, чтобы избежать циклических импортов
-            from handlers.student import show_stats
-            await show_stats(update, context)
-
-        elif query.data == "common_achievements":
-            await query.delete_message()
-            # Импортируем функцию здесь, чтобы избежать циклических импортов
-            from handlers.student import show_achievements
-            await show_achievements(update, context)
-
-        elif query.data == "common_help":
-            await query.delete_message()
-            # Импортируем функцию здесь, чтобы избежать циклических импортов
-            from handlers.start import help_command
-            await help_command(update, context)
-
-        elif query.data == "common_leaderboard":
-            await show_leaderboard(update, context)
-
         elif query.data.startswith("common_stats_"):
             # Обработка кнопок выбора периода в статистике
             period = query.data.replace("common_stats_", "")
@@ -261,13 +290,11 @@ async def handle_common_button(update: Update, context: ContextTypes.DEFAULT_TYP
 
             # Создаем аргументы для команды stats
             context.args = [period]
-            # Импортируем функцию здесь, чтобы избежать циклических импортов
-            from handlers.student import show_stats
-            await show_stats(update, context)
+            await _DISPATCH["common_stats"][0](update, context)
 
-    except Exception as e:
-        logger.error(f"Error in handle_common_button: {e}")
-        logger.error(traceback.format_exc())
+    except (SQLAlchemyError, TelegramError):
+        # Прочие исключения (в том числе CancelledError) уходят в error_handler
+        logger.exception("Error in handle_common_button")
         await query.edit_message_text(
             "Произошла ошибка при обработке запроса. Пожалуйста, попробуйте еще раз."
         )
@@ -300,12 +327,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик ошибок для логирования и информирования пользователя"""
-    logger.error(f"Exception while handling an update: {context.error}")
-
-    # Логируем трассировку ошибки
-    tb_list = traceback.format_exception(None, context.error, context.error.__traceback__)
-    tb_string = "".join(tb_list)
-    logger.error(f"Exception traceback: {tb_string}")
+    # Трассировку форматирует сам logging и только при включенном уровне ERROR
+    logger.error("Exception while handling an update", exc_info=context.error)
 
     # Отправляем сообщение пользователю
     if update and hasattr(update, "effective_chat"):
@@ -315,6 +338,17 @@ async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> N
         )
 
 
+def _cached_leaderboard(period: str, limit: int) -> dict:
+    """Таблица лидеров с кэшированием на LEADERBOARD_TTL секунд; ошибки не кэшируются"""
+    key = (period, limit)
+    result = _leaderboard_cache.get(key)
+    if result is None:
+        result = generate_leaderboard(period, limit=limit)
+        if result["success"]:
+            _leaderboard_cache[key] = result
+    return result
+
+
 async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Показать таблицу лидеров"""
     query = update.callback_query
@@ -324,8 +358,8 @@ async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -
     if period not in ["week", "month", "year", "all"]:
         period = "week"
 
-    # Получаем таблицу лидеров
-    leaderboard_result = generate_leaderboard(period, limit=10)
+    # Получаем таблицу лидеров (общая для всех пользователей, берется из кэша)
+    leaderboard_result = _cached_leaderboard(period, 10)
 
     if not leaderboard_result["success"]:
         if query:
@@ -339,85 +373,44 @@ async def show_leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         return
 
     if not leaderboard_result["has_data"]:
-        # Кнопки для выбора периода
-        keyboard = [
-            [
-                InlineKeyboardButton("За неделю", callback_data="common_leaderboard_week"),
-                InlineKeyboardButton("За месяц", callback_data="common_leaderboard_month")
-            ],
-            [
-                InlineKeyboardButton("За год", callback_data="common_leaderboard_year"),
-                InlineKeyboardButton("За всё время", callback_data="common_leaderboard_all")
-            ],
-            [
-                InlineKeyboardButton("🔙 Назад", callback_data="common_stats")
-            ]
-        ]
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
         if query:
             await query.edit_message_text(
                 f"За выбранный период ({get_period_name(period)}) нет данных для составления таблицы лидеров.",
-                reply_markup=reply_markup
+                reply_markup=_LEADERBOARD_PERIOD_MARKUP
             )
         else:
             await update.message.reply_text(
                 f"За выбранный период ({get_period_name(period)}) нет данных для составления таблицы лидеров.",
-                reply_markup=reply_markup
+                reply_markup=_LEADERBOARD_PERIOD_MARKUP
             )
         return
 
     # Формируем сообщение с таблицей лидеров
-    message = f"🏆 *Таблица лидеров за {get_period_name(period)}*\n\n"
+    lines = [f"🏆 *Таблица лидеров за {get_period_name(period)}*\n"]
 
     for i, user_data in enumerate(leaderboard_result["leaderboard"], 1):
         name = user_data["full_name"] or user_data["username"] or f"Ученик {user_data['id']}"
         score = user_data["score"]
         tests = user_data["tests_count"]
 
-        message += f"{i}. {name} - {score} баллов ({tests} тестов)\n"
-
-    # Кнопки для выбора периода
-    keyboard = [
-        [
-            InlineKeyboardButton("За неделю", callback_data="common_leaderboard_week"),
-            InlineKeyboardButton("За месяц", callback_data="common_leaderboard_month")
-        ],
-        [
-            InlineKeyboardButton("За год", callback_data="common_leaderboard_year"),
-            InlineKeyboardButton("За всё время", callback_data="common_leaderboard_all")
-        ],
-        [
-            InlineKeyboardButton("🔙 Назад", callback_data="common_stats")
-        ]
-    ]
+        lines.append(f"{i}. {name} - {score} баллов ({tests} тестов)")
 
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    message = "\n".join(lines) + "\n"
 
     if query:
         await query.edit_message_text(
             message,
-            reply_markup=reply_markup,
+            reply_markup=_LEADERBOARD_PERIOD_MARKUP,
             parse_mode="Markdown"
         )
     else:
         await update.message.reply_text(
             message,
-            reply_markup=reply_markup,
+            reply_markup=_LEADERBOARD_PERIOD_MARKUP,
             parse_mode="Markdown"
         )
 
 
 def get_period_name(period: str) -> str:
     """Получение названия периода на русском языке"""
-    if period == "week":
-        return "неделю"
-    elif period == "month":
-        return "месяц"
-    elif period == "year":
-        return "год"
-    elif period == "all":
-        return "всё время"
-    else:
-        return "неизвестный период"
\ No newline at end of file
+    return _PERIOD_NAMES.get(period, "неизвестный период")
\ No newline at end of file
@@ -1,28 +1,91 @@
 import logging
+import asyncio
+import functools
 import json
+import re
+import time
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 
 from services.parent_service import ParentService
-from database.models import User
-from database.db_manager import get_session
+from database.db_manager import get_user_role, peek_user_role
 
 logger = logging.getLogger(__name__)
 parent_service = ParentService()
 
+# Кнопки с параметром: parent_<действие>_<параметр>
+_CB_RE = re.compile(r"^parent_(student|report|settings|toggle|threshold)_(.+)$")
+
+# Время жизни списка привязанных учеников в context.user_data (секунды)
+LINKED_STUDENTS_TTL = 60
+
+# Шаблон текста отчета об успеваемости (Markdown)
+_REPORT_TEMPLATE = (
+    "📊 *Отчет об успеваемости ученика {name}*\n"
+    "*Период:* {period}\n\n"
+    "*Общие данные:*\n"
+    "• Пройдено тестов: {total}\n"
+    "• Средний результат: {avg}%\n"
+    "• Лучший результат: {best[score]}% ({best[topic]}, {best[date]})\n"
+    "• Худший результат: {worst[score]}% ({worst[topic]}, {worst[date]})\n"
+    "• Общее время: {time}\n\n"
+    "*Изученные темы ({n_topics}):\n*"
+    "{topics}"
+)
+
+# Пауза после последнего нажатия ▲/▼, после которой пороги записываются в БД (секунды)
+THRESHOLD_DEBOUNCE = 0.5
+
+
+async def _get_role(user_id: int):
+    """Роль пользователя из общего кэша; при промахе запрос к БД выполняется в отдельном потоке"""
+    role = peek_user_role(user_id)
+    if role is None:
+        role = await asyncio.to_thread(get_user_role, user_id)
+    return role
+
+
+@functools.lru_cache(maxsize=1024)
+def _period_markup(student_id: int) -> InlineKeyboardMarkup:
+    """Клавиатура выбора периода отчета для ученика (строится один раз на ученика)"""
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton("За неделю", callback_data=f"parent_report_{student_id}_week"),
+            InlineKeyboardButton("За месяц", callback_data=f"parent_report_{student_id}_month")
+        ],
+        [
+            InlineKeyboardButton("За год", callback_data=f"parent_report_{student_id}_year"),
+            InlineKeyboardButton("Назад к списку учеников", callback_data="parent_back_students")
+        ]
+    ])
+
+
+async def _linked_students(context: ContextTypes.DEFAULT_TYPE, user_id: int) -> dict:
+    """Список привязанных учеников с кэшированием в context.user_data
+
+    Одно нажатие кнопки может запрашивать список несколько раз; в БД уходит
+    один запрос в LINKED_STUDENTS_TTL секунд. Кэш сбрасывается после /link.
+    """
+    cached = context.user_data.get("linked_students")
+    if cached is not None and time.monotonic() - cached[0] < LINKED_STUDENTS_TTL:
+        return cached[1]
+
+    result = await asyncio.to_thread(parent_service.get_linked_students, user_id)
+    if result["success"]:
+        # Индекс по id для проверки и поиска ученика без перебора списка
+        result["students_by_id"] = {student["id"]: student for student in result["students"]}
+        context.user_data["linked_students"] = (time.monotonic(), result)
+    return result
+
 
 async def check_parent_role(update: Update) -> bool:
     """Проверка, является ли пользователь родителем"""
-    user_id = update.effective_user.id
-
-    with get_session() as session:
-        user = session.query(User).filter(User.telegram_id == user_id).first()
-        if not user or user.role != "parent":
-            await update.message.reply_text(
-                "Эта команда доступна только для родителей. "
-                "Пожалуйста, обратитесь к администратору для изменения роли."
-            )
-            return False
+    if await _get_role(update.effective_user.id) != "parent":
+        await update.message.reply_text(
+            "Эта команда доступна только для родителей. "
+            "Пожалуйста, обратитесь к администратору для изменения роли."
+        )
+        return False
     return True
 
 
@@ -32,20 +95,19 @@ async def link_student(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
     # Проверяем, является ли пользователь родителем
     try:
-        with get_session() as session:
-            user = session.query(User).filter(User.telegram_id == user_id).first()
-            if not user:
-                await update.message.reply_text(
-                    "Кажется, вы еще не зарегистрированы. Пожалуйста, используйте команду /start"
-                )
-                return
+        role = await _get_role(user_id)
+        if role is None:
+            await update.message.reply_text(
+                "Кажется, вы еще не зарегистрированы. Пожалуйста, используйте команду /start"
+            )
+            return
 
-            if user.role != "parent":
-                await update.message.reply_text(
-                    "Эта команда доступна только для родителей. "
-                    "Пожалуйста, обратитесь к администратору для изменения роли."
-                )
-                return
+        if role != "parent":
+            await update.message.reply_text(
+                "Эта команда доступна только для родителей. "
+                "Пожалуйста, обратитесь к администратору для изменения роли."
+            )
+            return
     except Exception as e:
         logger.error(f"Error checking parent role: {e}")
         await update.message.reply_text(
@@ -65,9 +127,11 @@ async def link_student(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     student_code = context.args[0]
 
     # Привязываем ученика
-    result = parent_service.link_student(user_id, student_code)
+    result = await asyncio.to_thread(parent_service.link_student, user_id, student_code)
 
     if result["success"]:
+        # Список учеников изменился
+        context.user_data.pop("linked_students", None)
         await update.message.reply_text(
             f"{result['message']}\n\n"
             "Теперь вы можете получать отчеты о его успеваемости."
@@ -87,7 +151,7 @@ async def get_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
     user_id = update.effective_user.id
 
     # Получаем список привязанных учеников
-    students_result = parent_service.get_linked_students(user_id)
+    students_result = await _linked_students(context, user_id)
 
     if not students_result["success"]:
         await update.message.reply_text(
@@ -96,6 +160,7 @@ async def get_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
         return
 
     students = students_result["students"]
+    students_by_id = students_result["students_by_id"]
 
     if not students:
         await update.message.reply_text(
@@ -112,13 +177,7 @@ async def get_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None
                 period = "week"
 
             # Проверяем, есть ли такой ученик среди привязанных
-            student_found = False
-            for student in students:
-                if student["id"] == student_id:
-                    student_found = True
-                    break
-
-            if not student_found:
+            if student_id not in students_by_id:
                 await update.message.reply_text(
                     "Указанный ученик не найден среди привязанных к вашему аккаунту."
                 )
@@ -159,7 +218,7 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
 
     # Получаем текущие настройки
-    settings_result = parent_service.get_parent_settings(user_id)
+    settings_result = await asyncio.to_thread(parent_service.get_parent_settings, user_id)
 
     if not settings_result["success"]:
         await update.message.reply_text(
@@ -168,7 +227,7 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     # Получаем список привязанных учеников
-    students_result = parent_service.get_linked_students(user_id)
+    students_result = await _linked_students(context, user_id)
 
     if not students_result["success"]:
         await update.message.reply_text(
@@ -177,6 +236,7 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         return
 
     students = students_result["students"]
+    students_by_id = students_result["students_by_id"]
 
     if not students:
         await update.message.reply_text(
@@ -190,19 +250,13 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             student_id = int(context.args[0])
 
             # Проверяем, есть ли такой ученик среди привязанных
-            student_found = False
-            student_name = ""
-            for student in students:
-                if student["id"] == student_id:
-                    student_found = True
-                    student_name = student["full_name"] or student["username"] or f"Ученик {student['id']}"
-                    break
-
-            if not student_found:
+            student = students_by_id.get(student_id)
+            if student is None:
                 await update.message.reply_text(
                     "Указанный ученик не найден среди привязанных к вашему аккаунту."
                 )
                 return
+            student_name = student["full_name"] or student["username"] or f"Ученик {student_id}"
 
             # Показываем настройки для ученика
             await show_student_settings(update, context, student_id, student_name)
@@ -238,210 +292,227 @@ async def handle_parent_button(update: Update, context: ContextTypes.DEFAULT_TYP
 
     user_id = update.effective_user.id
 
-    # Проверяем роль пользователя
-    with get_session() as session:
-        user = session.query(User).filter(User.telegram_id == user_id).first()
-        if not user or user.role != "parent":
-            await query.edit_message_text(
-                "Эта функция доступна только для родителей. "
-                "Пожалуйста, обратитесь к администратору для изменения роли."
-            )
-            return
+    # Проверяем роль пользователя (из кэша, без запроса к БД на каждое нажатие)
+    if await _get_role(user_id) != "parent":
+        await query.edit_message_text(
+            "Эта функция доступна только для родителей. "
+            "Пожалуйста, обратитесь к администратору для изменения роли."
+        )
+        return
 
     try:
-        if query.data.startswith("parent_student_"):
-            # Выбор ученика для отчета
-            student_id = int(query.data.replace("parent_student_", ""))
-
-            # Показываем меню выбора периода
-            keyboard = [
-                [
-                    InlineKeyboardButton("За неделю", callback_data=f"parent_report_{student_id}_week"),
-                    InlineKeyboardButton("За месяц", callback_data=f"parent_report_{student_id}_month")
-                ],
-                [
-                    InlineKeyboardButton("За год", callback_data=f"parent_report_{student_id}_year"),
-                    InlineKeyboardButton("Назад к списку учеников", callback_data="parent_back_students")
-                ]
-            ]
-
-            reply_markup = InlineKeyboardMarkup(keyboard)
+        # Сначала точное совпадение callback_data, затем разбор действия с параметром
+        handler = _EXACT.get(query.data)
+        if handler is not None:
+            await handler(update, context)
+        else:
+            match = _CB_RE.match(query.data)
+            if match:
+                action, payload = match.groups()
+                await _PREFIX[action](update, context, payload)
 
-            await query.edit_message_text(
-                "Выберите период для отчета:",
-                reply_markup=reply_markup
-            )
+    except Exception as e:
+        logger.error(f"Error in handle_parent_button: {e}")
+        await query.edit_message_text(
+            "Произошла ошибка при обработке запроса. Пожалуйста, попробуйте еще раз."
+        )
 
-        elif query.data.startswith("parent_report_"):
-            # Показ отчета об успеваемости
-            parts = query.data.split("_")
-            student_id = int(parts[2])
-            period = parts[3]
 
-            # Генерируем и показываем отчет
-            await show_student_report(update, context, student_id, period)
+async def _on_student(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    """Выбор ученика для отчета: меню выбора периода"""
+    query = update.callback_query
 
-        elif query.data.startswith("parent_settings_"):
-            # Настройки для ученика
-            student_id = int(query.data.replace("parent_settings_", ""))
+    student_id = int(payload)
 
-            # Получаем информацию об ученике
-            students_result = parent_service.get_linked_students(user_id)
-            if not students_result["success"]:
-                await query.edit_message_text(f"Ошибка: {students_result['message']}")
-                return
+    # Показываем меню выбора периода
+    reply_markup = _period_markup(student_id)
 
-            students = students_result["students"]
-            student_name = ""
-            for student in students:
-                if student["id"] == student_id:
-                    student_name = student["full_name"] or student["username"] or f"Ученик {student['id']}"
-                    break
+    await query.edit_message_text(
+        "Выберите период для отчета:",
+        reply_markup=reply_markup
+    )
 
-            # Показываем настройки для ученика
-            await show_student_settings(update, context, student_id, student_name, query=query)
 
-        elif query.data.startswith("parent_toggle_"):
-            # Переключение настроек уведомлений
-            parts = query.data.split("_")
-            setting_type = parts[2]
-            student_id = int(parts[3])
+async def _on_report(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    """Показ отчета об успеваемости за выбранный период"""
+    student_id, period = payload.split("_", 1)
+    student_id = int(student_id)
 
-            # Получаем текущие настройки
-            settings_result = parent_service.get_parent_settings(user_id)
+    # Генерируем и показываем отчет
+    await show_student_report(update, context, student_id, period)
 
-            if not settings_result["success"]:
-                await query.edit_message_text(f"Ошибка получения настроек: {settings_result['message']}")
-                return
 
-            settings = settings_result["settings"]
+async def _on_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    """Настройки уведомлений для выбранного ученика"""
+    query = update.callback_query
+    user_id = update.effective_user.id
 
-            # Убеждаемся, что структура настроек существует
-            if "student_notifications" not in settings:
-                settings["student_notifications"] = {}
+    student_id = int(payload)
+    await _flush_thresholds(context, user_id, student_id)
 
-            if str(student_id) not in settings["student_notifications"]:
-                settings["student_notifications"][str(student_id)] = {}
+    # Получаем информацию об ученике
+    students_result = await _linked_students(context, user_id)
+    if not students_result["success"]:
+        await query.edit_message_text(f"Ошибка: {students_result['message']}")
+        return
 
-            student_settings = settings["student_notifications"][str(student_id)]
+    student = students_result["students_by_id"].get(student_id)
+    student_name = (student["full_name"] or student["username"] or f"Ученик {student_id}") if student else ""
 
-            # Переключаем настройку
-            current_value = student_settings.get(setting_type, False)
-            student_settings[setting_type] = not current_value
+    # Показываем настройки для ученика
+    await show_student_settings(update, context, student_id, student_name, query=query)
 
-            # Сохраняем настройки
-            result = parent_service.setup_notifications(user_id, student_id, student_settings)
 
-            if not result["success"]:
-                await query.edit_message_text(f"Ошибка сохранения настроек: {result['message']}")
-                return
+async def _on_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    """Переключение настройки уведомлений"""
+    query = update.callback_query
+    user_id = update.effective_user.id
 
-            # Получаем имя ученика
-            students_result = parent_service.get_linked_students(user_id)
-            student_name = ""
-            if students_result["success"]:
-                for student in students_result["students"]:
-                    if student["id"] == student_id:
-                        student_name = student["full_name"] or student["username"] or f"Ученик {student['id']}"
-                        break
-
-            # Показываем обновленные настройки
-            await show_student_settings(update, context, student_id, student_name, query=query)
-
-        elif query.data.startswith("parent_threshold_"):
-            # Изменение порогового значения
-            parts = query.data.split("_")
-            threshold_type = parts[2]
-            student_id = int(parts[3])
-            action = parts[4]  # up или down
-
-            # Получаем текущие настройки
-            settings_result = parent_service.get_parent_settings(user_id)
-
-            if not settings_result["success"]:
-                await query.edit_message_text(f"Ошибка получения настроек: {settings_result['message']}")
-                return
+    # Тип настройки сам содержит "_" (weekly_reports), поэтому id ученика отделяется справа
+    setting_type, student_id = payload.rsplit("_", 1)
+    student_id = int(student_id)
 
-            settings = settings_result["settings"]
+    # Несохраненные пороги записываем до изменения настроек
+    await _flush_thresholds(context, user_id, student_id)
 
-            # Убеждаемся, что структура настроек существует
-            if "student_notifications" not in settings:
-                settings["student_notifications"] = {}
+    # Переключение выполняется в одной транзакции; сервис возвращает итоговые настройки
+    result = await asyncio.to_thread(parent_service.toggle_notification, user_id, student_id, setting_type)
 
-            if str(student_id) not in settings["student_notifications"]:
-                settings["student_notifications"][str(student_id)] = {}
+    if not result["success"]:
+        await query.edit_message_text(f"Ошибка сохранения настроек: {result['message']}")
+        return
 
-            student_settings = settings["student_notifications"][str(student_id)]
+    # Получаем имя ученика
+    students_result = await _linked_students(context, user_id)
+    student = students_result["students_by_id"].get(student_id) if students_result["success"] else None
+    student_name = (student["full_name"] or student["username"] or f"Ученик {student_id}") if student else ""
 
-            # Устанавливаем значения по умолчанию
-            if threshold_type == "low_score_threshold" and threshold_type not in student_settings:
-                student_settings[threshold_type] = 60
-            elif threshold_type == "high_score_threshold" and threshold_type not in student_settings:
-                student_settings[threshold_type] = 90
+    # Показываем обновленные настройки
+    await show_student_settings(update, context, student_id, student_name, query=query,
+                                student_settings=result["settings"])
 
-            # Изменяем пороговое значение
-            current_value = student_settings.get(threshold_type,
-                                                 60 if threshold_type == "low_score_threshold" else 90)
 
-            if action == "up":
-                new_value = min(current_value + 5, 100)
-            else:  # down
-                new_value = max(current_value - 5, 0)
+async def _on_threshold(update: Update, context: ContextTypes.DEFAULT_TYPE, payload: str) -> None:
+    """Изменение порогового значения"""
+    query = update.callback_query
+    user_id = update.effective_user.id
 
-            student_settings[threshold_type] = new_value
+    # Параметр: <тип порога>_<id ученика>_<up|down|none>
+    threshold_type, student_id, action = payload.rsplit("_", 2)
+    student_id = int(student_id)
 
-            # Сохраняем настройки
-            result = parent_service.setup_notifications(user_id, student_id, student_settings)
+    if action not in ("up", "down"):
+        # Кнопка с текущим значением порога только подписывает ряд
+        return
 
-            if not result["success"]:
-                await query.edit_message_text(f"Ошибка сохранения настроек: {result['message']}")
-                return
+    # Частые нажатия ▲/▼ накапливаются в памяти и записываются в БД
+    # одним вызовом после паузы THRESHOLD_DEBOUNCE секунд
+    pending_thresholds = context.user_data.setdefault("pending_thresholds", {})
+    pending = pending_thresholds.get(student_id)
+    if pending is None:
+        settings_result = await asyncio.to_thread(parent_service.get_parent_settings, user_id)
 
-            # Получаем имя ученика
-            students_result = parent_service.get_linked_students(user_id)
-            student_name = ""
-            if students_result["success"]:
-                for student in students_result["students"]:
-                    if student["id"] == student_id:
-                        student_name = student["full_name"] or student["username"] or f"Ученик {student['id']}"
-                        break
+        if not settings_result["success"]:
+            await query.edit_message_text(f"Ошибка получения настроек: {settings_result['message']}")
+            return
 
-            # Показываем обновленные настройки
-            await show_student_settings(update, context, student_id, student_name, query=query)
+        base = settings_result["settings"].get("student_notifications", {}).get(str(student_id), {})
+        pending = {"base": base, "changes": {}, "task": None, "lock": asyncio.Lock()}
+        pending_thresholds[student_id] = pending
+    elif pending["task"] is not None:
+        pending["task"].cancel()
 
-        elif query.data == "parent_back_students":
-            # Возврат к списку учеников
-            students_result = parent_service.get_linked_students(user_id)
+    student_settings = {**pending["base"], **pending["changes"]}
 
-            if not students_result["success"]:
-                await query.edit_message_text(f"Ошибка: {students_result['message']}")
-                return
+    # Изменяем пороговое значение
+    current_value = student_settings.get(threshold_type,
+                                         60 if threshold_type == "low_score_threshold" else 90)
 
-            students = students_result["students"]
+    if action == "up":
+        new_value = min(current_value + 5, 100)
+    else:  # down
+        new_value = max(current_value - 5, 0)
 
-            # Показываем меню выбора ученика
-            keyboard = []
-            for student in students:
-                name = student["full_name"] or student["username"] or f"Ученик {student['id']}"
-                keyboard.append([
-                    InlineKeyboardButton(
-                        name,
-                        callback_data=f"parent_student_{student['id']}"
-                    )
-                ])
+    pending["changes"][threshold_type] = new_value
+    student_settings[threshold_type] = new_value
+    pending["task"] = context.application.create_task(
+        _flush_thresholds(context, user_id, student_id, delay=THRESHOLD_DEBOUNCE)
+    )
 
-            reply_markup = InlineKeyboardMarkup(keyboard)
+    # Получаем имя ученика
+    students_result = await _linked_students(context, user_id)
+    student = students_result["students_by_id"].get(student_id) if students_result["success"] else None
+    student_name = (student["full_name"] or student["username"] or f"Ученик {student_id}") if student else ""
 
-            await query.edit_message_text(
-                "Выберите ученика для просмотра отчета:",
-                reply_markup=reply_markup
+    # Показываем обновленные настройки из памяти, не дожидаясь записи в БД
+    await show_student_settings(update, context, student_id, student_name, query=query,
+                                student_settings=student_settings)
+
+
+async def _on_back_students(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Возврат к списку учеников"""
+    query = update.callback_query
+    user_id = update.effective_user.id
+
+    students_result = await _linked_students(context, user_id)
+
+    if not students_result["success"]:
+        await query.edit_message_text(f"Ошибка: {students_result['message']}")
+        return
+
+    students = students_result["students"]
+
+    # Показываем меню выбора ученика
+    keyboard = []
+    for student in students:
+        name = student["full_name"] or student["username"] or f"Ученик {student['id']}"
+        keyboard.append([
+            InlineKeyboardButton(
+                name,
+                callback_data=f"parent_student_{student['id']}"
             )
+        ])
 
-    except Exception as e:
-        logger.error(f"Error in handle_parent_button: {e}")
-        await query.edit_message_text(
-            "Произошла ошибка при обработке запроса. Пожалуйста, попробуйте еще раз."
-        )
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    await query.edit_message_text(
+        "Выберите ученика для просмотра отчета:",
+        reply_markup=reply_markup
+    )
+
+
+async def _flush_thresholds(context: ContextTypes.DEFAULT_TYPE, user_id: int, student_id: int,
+                            delay: float = 0) -> None:
+    """Запись накопленных изменений порогов в БД (с задержкой delay секунд)
+
+    Без задержки вызывается перед другими действиями с настройками ученика,
+    чтобы они читали уже сохраненные значения.
+    """
+    if delay:
+        await asyncio.sleep(delay)
+
+    pending_thresholds = context.user_data.get("pending_thresholds", {})
+    pending = pending_thresholds.get(student_id)
+    if pending is None:
+        return
+    if not delay and pending["task"] is not None:
+        pending["task"].cancel()
+    # Нажатия во время записи не отменяют ее, а планируют следующую
+    pending["task"] = None
+
+    # Запись остается в pending_thresholds до завершения записи в БД: нажатия
+    # в это время продолжают отсчет от накопленных значений, а не от строки в БД,
+    # еще не получившей изменения. Блокировка сохраняет порядок записей
+    async with pending["lock"]:
+        changes, pending["changes"] = pending["changes"], {}
+        if changes:
+            pending["base"] = {**pending["base"], **changes}
+            result = await asyncio.to_thread(parent_service.update_student_settings, user_id, student_id, changes)
+            if not result["success"]:
+                logger.error(f"Error saving thresholds for parent {user_id}, student {student_id}: {result['message']}")
+
+        if not pending["changes"] and pending["task"] is None and pending_thresholds.get(student_id) is pending:
+            del pending_thresholds[student_id]
 
 
 async def show_student_report(update: Update, context: ContextTypes.DEFAULT_TYPE, student_id: int, period: str) -> None:
@@ -450,7 +521,7 @@ async def show_student_report(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
 
     # Генерируем отчет
-    report_result = parent_service.generate_student_report(user_id, student_id, period)
+    report_result = await asyncio.to_thread(parent_service.generate_student_report, user_id, student_id, period)
 
     if not report_result["success"]:
         if query:
@@ -461,18 +532,7 @@ async def show_student_report(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     if not report_result["has_data"]:
         # Кнопки для выбора другого периода и возврата
-        keyboard = [
-            [
-                InlineKeyboardButton("За неделю", callback_data=f"parent_report_{student_id}_week"),
-                InlineKeyboardButton("За месяц", callback_data=f"parent_report_{student_id}_month")
-            ],
-            [
-                InlineKeyboardButton("За год", callback_data=f"parent_report_{student_id}_year"),
-                InlineKeyboardButton("Назад к списку учеников", callback_data="parent_back_students")
-            ]
-        ]
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        reply_markup = _period_markup(student_id)
 
         if query:
             await query.edit_message_text(
@@ -491,35 +551,20 @@ async def show_student_report(update: Update, context: ContextTypes.DEFAULT_TYPE
     period_name = get_period_name(period)
     stats = report_result["stats"]
 
-    report_text = f"📊 *Отчет об успеваемости ученика {student_name}*\n"
-    report_text += f"*Период:* {period_name}\n\n"
-
-    report_text += f"*Общие данные:*\n"
-    report_text += f"• Пройдено тестов: {stats['total_tests']}\n"
-    report_text += f"• Средний результат: {stats['average_score']}%\n"
-    report_text += f"• Лучший результат: {stats['best_result']['score']}% "
-    report_text += f"({stats['best_result']['topic']}, {stats['best_result']['date']})\n"
-    report_text += f"• Худший результат: {stats['worst_result']['score']}% "
-    report_text += f"({stats['worst_result']['topic']}, {stats['worst_result']['date']})\n"
-    report_text += f"• Общее время: {format_time(stats['total_time_spent'])}\n\n"
-
-    report_text += f"*Изученные темы ({len(stats['topics_studied'])}):\n*"
-    for topic in stats['topics_studied']:
-        report_text += f"• {topic}\n"
+    report_text = _REPORT_TEMPLATE.format(
+        name=student_name,
+        period=period_name,
+        total=stats['total_tests'],
+        avg=stats['average_score'],
+        best=stats['best_result'],
+        worst=stats['worst_result'],
+        time=format_time(stats['total_time_spent']),
+        n_topics=len(stats['topics_studied']),
+        topics="".join(f"• {topic}\n" for topic in stats['topics_studied'])
+    )
 
     # Кнопки для выбора другого периода и возврата
-    keyboard = [
-        [
-            InlineKeyboardButton("За неделю", callback_data=f"parent_report_{student_id}_week"),
-            InlineKeyboardButton("За месяц", callback_data=f"parent_report_{student_id}_month")
-        ],
-        [
-            InlineKeyboardButton("За год", callback_data=f"parent_report_{student_id}_year"),
-            InlineKeyboardButton("Назад к списку учеников", callback_data="parent_back_students")
-        ]
-    ]
-
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    reply_markup = _period_markup(student_id)
 
     # Отправляем отчет
     if query:
@@ -551,30 +596,27 @@ async def show_student_report(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 
 async def show_student_settings(update: Update, context: ContextTypes.DEFAULT_TYPE, student_id: int, student_name: str,
-                                query=None) -> None:
-    """Показ и редактирование настроек для ученика"""
-    user_id = update.effective_user.id
-
-    # Получаем текущие настройки
-    settings_result = parent_service.get_parent_settings(user_id)
+                                query=None, student_settings: dict = None) -> None:
+    """Показ и редактирование настроек для ученика
 
-    if not settings_result["success"]:
-        if query:
-            await query.edit_message_text(f"Ошибка получения настроек: {settings_result['message']}")
-        else:
-            await update.message.reply_text(f"Ошибка получения настроек: {settings_result['message']}")
-        return
-
-    settings = settings_result["settings"]
+    Если student_settings переданы (еще не записанные в БД пороги), они
+    показываются без повторного чтения настроек из БД.
+    """
+    user_id = update.effective_user.id
 
-    # Получаем настройки для конкретного ученика
-    if "student_notifications" not in settings:
-        settings["student_notifications"] = {}
+    if student_settings is None:
+        # Получаем текущие настройки
+        settings_result = await asyncio.to_thread(parent_service.get_parent_settings, user_id)
 
-    if str(student_id) not in settings["student_notifications"]:
-        settings["student_notifications"][str(student_id)] = {}
+        if not settings_result["success"]:
+            if query:
+                await query.edit_message_text(f"Ошибка получения настроек: {settings_result['message']}")
+            else:
+                await update.message.reply_text(f"Ошибка получения настроек: {settings_result['message']}")
+            return
 
-    student_settings = settings["student_notifications"][str(student_id)]
+        # Получаем настройки для конкретного ученика
+        student_settings = settings_result["settings"].get("student_notifications", {}).get(str(student_id), {})
 
     # Значения по умолчанию
     weekly_reports = student_settings.get("weekly_reports", False)
@@ -685,4 +727,20 @@ def format_time(minutes: int) -> str:
     if hours > 0:
         return f"{hours} ч {mins} мин"
     else:
-        return f"{mins} мин"
\ No newline at end of file
+        return f"{mins} мин"
+
+
+# Таблицы маршрутизации кнопок раздела родителя. Объявлены в конце модуля,
+# так как ссылаются на обработчики, определенные выше
+_EXACT = {
+    "parent_back_students": _on_back_students,
+}
+
+# Обработчики кнопок с параметром: ключ - действие из _CB_RE, параметр передается отдельно
+_PREFIX = {
+    "student": _on_student,
+    "report": _on_report,
+    "settings": _on_settings,
+    "toggle": _on_toggle,
+    "threshold": _on_threshold,
+}
@@ -4,7 +4,7 @@ from telegram.ext import ContextTypes
 from datetime import datetime
 
 from database.models import User
-from database.db_manager import get_session
+from database.db_manager import get_session, get_user_by_tg, invalidate_user
 from config import ADMINS
 
 logger = logging.getLogger(__name__)
@@ -18,7 +18,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     full_name = f"{user.first_name} {user.last_name if user.last_name else ''}"
 
     # Определим роль пользователя (админ/родитель/ученик)
-    role = "admin" if str(user_id) in ADMINS else None
+    role = "admin" if user_id in ADMINS else None
 
     # Проверяем, существует ли пользователь в базе
     with get_session() as session:
@@ -55,6 +55,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             )
             session.add(new_user)
             session.commit()
+            invalidate_user(user_id)
 
             # Сообщаем о создании нового аккаунта
             if role == "admin":
@@ -76,6 +77,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             db_user.full_name = full_name
             db_user.last_active = datetime.utcnow()
             session.commit()
+            invalidate_user(user_id)
 
             # Приветствуем существующего пользователя
             if db_user.role == "admin":
@@ -97,16 +99,15 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     user_id = update.effective_user.id
 
     # Получаем роль пользователя
-    with get_session() as session:
-        user = session.query(User).filter(User.telegram_id == user_id).first()
+    cached_user = get_user_by_tg(user_id)
 
-        if not user:
-            await update.message.reply_text(
-                "Кажется, вы еще не зарегистрированы. Пожалуйста, используйте команду /start"
-            )
-            return
+    if not cached_user:
+        await update.message.reply_text(
+            "Кажется, вы еще не зарегистрированы. Пожалуйста, используйте команду /start"
+        )
+        return
 
-        role = user.role
+    _, role = cached_user
 
     # Формируем сообщение с помощью в зависимости от роли
     if role == "student":
@@ -232,28 +233,28 @@ async def mycode_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = update.effective_user.id
 
     # Проверяем, что пользователь является учеником
-    with get_session() as session:
-        user = session.query(User).filter(User.telegram_id == user_id).first()
+    cached_user = get_user_by_tg(user_id)
 
-        if not user:
-            await update.message.reply_text(
-                "Кажется, вы еще не зарегистрированы. Пожалуйста, используйте команду /start"
-            )
-            return
+    if not cached_user:
+        await update.message.reply_text(
+            "Кажется, вы еще не зарегистрированы. Пожалуйста, используйте команду /start"
+        )
+        return
 
-        if user.role != "student":
-            await update.message.reply_text(
-                "Эта команда доступна только для учеников."
-            )
-            return
+    _, role = cached_user
+    if role != "student":
+        await update.message.reply_text(
+            "Эта команда доступна только для учеников."
+        )
+        return
 
-        # Код привязки - это просто telegram_id ученика (в реальной системе можно использовать более сложный код)
-        code = str(user_id)
+    # Код привязки - это просто telegram_id ученика (в реальной системе можно использовать более сложный код)
+    code = str(user_id)
 
-        await update.message.reply_text(
-            f"📱 *Ваш код для привязки родителя:*\n\n"
-            f"`{code}`\n\n"
-            f"Передайте этот код родителю, чтобы он мог отслеживать вашу успеваемость.\n"
-            f"Родитель должен использовать команду /link {code}",
-            parse_mode="Markdown"
-        )
\ No newline at end of file
+    await update.message.reply_text(
+        f"📱 *Ваш код для привязки родителя:*\n\n"
+        f"`{code}`\n\n"
+        f"Передайте этот код родителю, чтобы он мог отслеживать вашу успеваемость.\n"
+        f"Родитель должен использовать команду /link {code}",
+        parse_mode="Markdown"
+    )
\ No newline at end of file
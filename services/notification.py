@@ -1,6 +1,5 @@
 import logging
 import asyncio
-import json
 import traceback
 from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
@@ -19,6 +18,8 @@ class NotificationService:
     def __init__(self, application: Application):
         """Инициализация сервиса уведомлений"""
         self.application = application
+        # Используем бота приложения и его пул соединений, отдельный Bot не создаем
+        self.bot = application.bot
         self.scheduler = None
         self._running = False
         self.parent_service = ParentService()
@@ -89,7 +90,7 @@ class NotificationService:
 
                 for notification in notifications:
                     # Получаем пользователя
-                    user = session.query(User).get(notification.user_id)
+                    user = session.get(User, notification.user_id)
                     if not user:
                         logger.warning(f"User not found for notification {notification.id}")
                         notification.is_read = True
@@ -97,7 +98,7 @@ class NotificationService:
 
                     # Отправляем уведомление
                     try:
-                        await self.application.bot.send_message(
+                        await self.bot.send_message(
                             chat_id=user.telegram_id,
                             text=f"*{notification.title}*\n\n{notification.message}",
                             parse_mode="Markdown"
@@ -147,7 +148,7 @@ class NotificationService:
 
                 for student in inactive_students:
                     try:
-                        await self.application.bot.send_message(
+                        await self.bot.send_message(
                             chat_id=student.telegram_id,
                             text="👋 Привет! Не забывай регулярно проверять свои знания по истории.\n"
                                  "Используй команду /test, чтобы начать тестирование."
@@ -167,7 +168,7 @@ class NotificationService:
         try:
             with get_session() as session:
                 # Проверяем существование пользователя
-                user = session.query(User).get(user_id)
+                user = session.get(User, user_id)
                 if not user:
                     return False
 
@@ -197,7 +198,7 @@ class NotificationService:
         try:
             # Получаем данные ученика
             with get_session() as session:
-                student = session.query(User).get(student_id)
+                student = session.get(User, student_id)
                 if not student or student.role != "student":
                     return
 
@@ -239,7 +240,7 @@ class NotificationService:
                     if not parent.settings:
                         continue
 
-                    settings = json.loads(parent.settings)
+                    settings = parent.settings
 
                     if "student_notifications" not in settings:
                         continue
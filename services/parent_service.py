@@ -1,10 +1,8 @@
-import json
 import logging
-import pandas as pd
-import matplotlib.pyplot as plt
 from datetime import datetime, timedelta
 from io import BytesIO
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Callable
+import threading
 import traceback
 
 from database.models import User, TestResult, Topic, Notification
@@ -13,6 +11,9 @@ from services.stats_service import get_user_stats
 
 logger = logging.getLogger(__name__)
 
+# Блокировка для построения графиков matplotlib из нескольких потоков
+_plot_lock = threading.Lock()
+
 
 class ParentService:
     def __init__(self):
@@ -92,6 +93,11 @@ class ParentService:
 
     def generate_student_report(self, parent_id: int, student_id: int, period: str = "week") -> Dict[str, Any]:
         """Генерация отчета о прогрессе ученика за указанный период"""
+        # pandas и matplotlib импортируются при первом построении отчета,
+        # а не при запуске бота
+        import pandas as pd
+        import matplotlib.pyplot as plt
+
         try:
             with get_session() as session:
                 # Проверяем, что родитель существует
@@ -137,7 +143,7 @@ class ParentService:
                     }
 
                 # Собираем данные для отчета
-                topics = {topic.id: topic.name for topic in session.query(Topic).all()}
+                topics = dict(session.query(Topic.id, Topic.name).all())
 
                 # Преобразуем результаты в DataFrame для анализа
                 df = pd.DataFrame([
@@ -153,31 +159,33 @@ class ParentService:
                     for result in test_results
                 ])
 
-                # Создаем график успеваемости
-                plt.figure(figsize=(10, 6))
-                for topic_id, group in df.groupby("topic_id"):
-                    plt.plot(
-                        group["date"],
-                        group["percentage"],
-                        "o-",
-                        label=group["topic_name"].iloc[0]
-                    )
-
-                plt.title(f"Успеваемость ученика {student.full_name or student.username}")
-                plt.xlabel("Дата")
-                plt.ylabel("Процент правильных ответов")
-                plt.grid(True)
-                plt.xticks(rotation=45)
-                plt.tight_layout()
-
-                if len(df["topic_id"].unique()) > 1:
-                    plt.legend()
-
-                # Сохраняем график в буфер
-                img_buf = BytesIO()
-                plt.savefig(img_buf, format='png')
-                img_buf.seek(0)
-                plt.close()
+                # Создаем график успеваемости. Состояние pyplot глобальное, а отчеты
+                # строятся в рабочих потоках, поэтому построение выполняется под блокировкой
+                with _plot_lock:
+                    plt.figure(figsize=(10, 6))
+                    for topic_id, group in df.groupby("topic_id"):
+                        plt.plot(
+                            group["date"],
+                            group["percentage"],
+                            "o-",
+                            label=group["topic_name"].iloc[0]
+                        )
+
+                    plt.title(f"Успеваемость ученика {student.full_name or student.username}")
+                    plt.xlabel("Дата")
+                    plt.ylabel("Процент правильных ответов")
+                    plt.grid(True)
+                    plt.xticks(rotation=45)
+                    plt.tight_layout()
+
+                    if len(df["topic_id"].unique()) > 1:
+                        plt.legend()
+
+                    # Сохраняем график в буфер
+                    img_buf = BytesIO()
+                    plt.savefig(img_buf, format='png')
+                    img_buf.seek(0)
+                    plt.close()
 
                 # Статистика
                 stats = {
@@ -229,18 +237,14 @@ class ParentService:
                 if not student:
                     return {"success": False, "message": "Ученик не найден среди привязанных учеников"}
 
-                # Обновляем настройки уведомлений
-                parent_settings = json.loads(parent.settings or "{}")
-
-                # Если нет настроек для этого ученика, создаем их
-                if "student_notifications" not in parent_settings:
-                    parent_settings["student_notifications"] = {}
-
-                # Обновляем настройки для указанного ученика
-                parent_settings["student_notifications"][str(student.id)] = settings
+                # Обновляем настройки уведомлений. Новый словарь вместо изменения
+                # на месте: изменения внутри JSON-значения SQLAlchemy не отслеживает
+                parent_settings = parent.settings or {}
+                student_notifications = dict(parent_settings.get("student_notifications", {}))
+                student_notifications[str(student.id)] = settings
 
                 # Сохраняем настройки
-                parent.settings = json.dumps(parent_settings)
+                parent.settings = {**parent_settings, "student_notifications": student_notifications}
                 session.commit()
 
                 return {
@@ -252,6 +256,54 @@ class ParentService:
             logger.error(f"Error setting up notifications: {e}")
             return {"success": False, "message": f"Произошла ошибка: {str(e)}"}
 
+    def update_student_settings(self, parent_id: int, student_id: int, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """Изменение отдельных настроек уведомлений об ученике (остальные сохраняются)"""
+        return self._modify_student_settings(parent_id, student_id, lambda settings: settings.update(changes))
+
+    def toggle_notification(self, parent_id: int, student_id: int, setting: str) -> Dict[str, Any]:
+        """Переключение флага уведомлений об ученике (weekly_reports, test_completion)"""
+        return self._modify_student_settings(
+            parent_id, student_id, lambda settings: settings.update({setting: not settings.get(setting, False)})
+        )
+
+    def _modify_student_settings(self, parent_id: int, student_id: int,
+                                 modify: Callable[[Dict[str, Any]], None]) -> Dict[str, Any]:
+        """Чтение, изменение и запись настроек ученика в одной транзакции
+
+        Строка родителя блокируется до commit (SELECT ... FOR UPDATE в PostgreSQL),
+        поэтому одновременные нажатия не затирают изменения друг друга.
+        Возвращает итоговые настройки ученика для отображения без повторного чтения.
+        """
+        try:
+            with get_session() as session:
+                parent = (
+                    session.query(User)
+                    .filter(User.telegram_id == parent_id)
+                    .with_for_update()
+                    .first()
+                )
+                if not parent:
+                    return {"success": False, "message": "Аккаунт родителя не найден"}
+
+                if not any(child.id == student_id for child in parent.children):
+                    return {"success": False, "message": "Ученик не найден среди привязанных учеников"}
+
+                parent_settings = parent.settings or {}
+                student_notifications = dict(parent_settings.get("student_notifications", {}))
+                student_settings = dict(student_notifications.get(str(student_id), {}))
+                modify(student_settings)
+                student_notifications[str(student_id)] = student_settings
+
+                # Новый словарь вместо изменения на месте, чтобы SQLAlchemy увидел изменение
+                parent.settings = {**parent_settings, "student_notifications": student_notifications}
+                session.commit()
+
+                return {"success": True, "settings": student_settings}
+
+        except Exception as e:
+            logger.error(f"Error updating student settings: {e}")
+            return {"success": False, "message": f"Произошла ошибка: {str(e)}"}
+
     def send_scheduled_reports(self) -> None:
         """Отправка запланированных отчетов родителям"""
         try:
@@ -264,7 +316,7 @@ class ParentService:
                     if not parent.settings:
                         continue
 
-                    settings = json.loads(parent.settings)
+                    settings = parent.settings
                     if "student_notifications" not in settings:
                         continue
 
@@ -282,7 +334,7 @@ class ParentService:
                             continue
 
                         # Генерируем отчет
-                        student = session.query(User).get(student_id)
+                        student = session.get(User, student_id)
                         if not student:
                             continue
 
@@ -306,7 +358,7 @@ class ParentService:
         try:
             with get_session() as session:
                 # Находим ученика
-                student = session.query(User).get(student_id)
+                student = session.get(User, student_id)
                 if not student:
                     return
 
@@ -324,7 +376,7 @@ class ParentService:
                     if not parent.settings:
                         continue
 
-                    settings = json.loads(parent.settings)
+                    settings = parent.settings
                     if "student_notifications" not in settings:
                         continue
 
@@ -368,15 +420,7 @@ class ParentService:
                 if not parent:
                     return {"success": False, "message": "Аккаунт родителя не найден"}
 
-                settings = {}
-                if parent.settings:
-                    try:
-                        settings = json.loads(parent.settings)
-                    except json.JSONDecodeError:
-                        logger.warning(f"Invalid JSON in parent settings for user {parent_id}")
-                        settings = {}
-
-                return {"success": True, "settings": settings}
+                return {"success": True, "settings": parent.settings or {}}
 
         except Exception as e:
             logger.error(f"Error getting parent settings: {e}")
@@ -396,11 +440,7 @@ class ParentService:
                     if not parent.settings:
                         continue
 
-                    try:
-                        settings = json.loads(parent.settings)
-                    except json.JSONDecodeError:
-                        logger.warning(f"Invalid JSON in parent settings for user {parent.id}")
-                        continue
+                    settings = parent.settings
 
                     # Пропускаем, если нет настроек уведомлений о детях
                     if "student_notifications" not in settings:
@@ -416,7 +456,7 @@ class ParentService:
                             student_id = int(student_id_str)
 
                             # Проверяем, что ученик существует
-                            student = session.query(User).get(student_id)
+                            student = session.get(User, student_id)
                             if not student or student.role != "student":
                                 logger.warning(f"Student {student_id} not found or not a student")
                                 continue
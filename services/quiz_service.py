@@ -1,4 +1,3 @@
-import json
 import random
 import os
 import logging
@@ -7,10 +6,11 @@ from typing import List, Dict, Any, Optional, Tuple
 from sqlalchemy.orm import Session
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
-from database.models import Question, TestResult, User, Topic, Achievement
+from database.models import Question, TestResult, User, Achievement
 from database.db_manager import get_session
 from utils.formatters import format_question_text
 from services.stats_service import update_user_stats
+from services import topic_cache
 from utils.image_utils import get_image_path
 
 logger = logging.getLogger(__name__)
@@ -35,9 +35,10 @@ class QuizService:
 
     def get_topics(self) -> List[Dict[str, Any]]:
         """Получение списка всех доступных тем для тестирования"""
-        with get_session() as session:
-            topics = session.query(Topic).all()
-            return [{"id": t.id, "name": t.name, "description": t.description} for t in topics]
+        return [
+            {"id": topic_id, "name": name, "description": description}
+            for topic_id, name, description in topic_cache.get_topics_cached()
+        ]
 
     def start_quiz(self, user_id: int, topic_id: int, question_count: int = 10) -> Dict[str, Any]:
         """Начать новый тест для пользователя"""
@@ -63,8 +64,8 @@ class QuizService:
                     {
                         "id": q.id,
                         "text": q.text,
-                        "options": json.loads(q.options),
-                        "correct_answer": json.loads(q.correct_answer),
+                        "options": q.options,
+                        "correct_answer": q.correct_answer,
                         "question_type": q.question_type,
                         "explanation": q.explanation,
                         "media_url": q.media_url
@@ -1,6 +1,4 @@
 import json
-import pandas as pd
-import matplotlib.pyplot as plt
 from io import BytesIO
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional, Tuple
@@ -11,6 +9,11 @@ from database.db_manager import get_session
 
 def get_user_stats(user_id: int, period: str = "all") -> Dict[str, Any]:
     """Получение статистики пользователя за указанный период"""
+    # pandas и matplotlib импортируются при первом построении отчета,
+    # а не при запуске бота
+    import pandas as pd
+    import matplotlib.pyplot as plt
+
     try:
         with get_session() as session:
             # Находим пользователя
@@ -43,7 +46,7 @@ def get_user_stats(user_id: int, period: str = "all") -> Dict[str, Any]:
                 }
 
             # Получаем информацию о темах
-            topics = {topic.id: topic.name for topic in session.query(Topic).all()}
+            topics = dict(session.query(Topic.id, Topic.name).all())
 
             # Собираем данные для статистики
             results_data = []
@@ -234,7 +237,7 @@ def generate_leaderboard(period: str = "week", limit: int = 10) -> Dict[str, Any
             # Рассчитываем средний балл для каждого пользователя
             leaderboard_data = []
             for user_id, results in user_results.items():
-                user = session.query(User).get(user_id)
+                user = session.get(User, user_id)
                 if not user or user.role != "student":
                     continue
 
@@ -271,6 +274,8 @@ def generate_leaderboard(period: str = "week", limit: int = 10) -> Dict[str, Any
 
 def generate_topic_analytics() -> Dict[str, Any]:
     """Анализ результатов по разным темам для выявления сложных/простых тем"""
+    import matplotlib.pyplot as plt
+
     try:
         with get_session() as session:
             # Получаем все результаты тестов
@@ -284,7 +289,7 @@ def generate_topic_analytics() -> Dict[str, Any]:
                 }
 
             # Получаем информацию о темах
-            topics = {topic.id: topic.name for topic in session.query(Topic).all()}
+            topics = dict(session.query(Topic.id, Topic.name).all())
 
             # Группируем результаты по темам
             topic_results = {}
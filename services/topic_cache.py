@@ -0,0 +1,60 @@
+import threading
+import time
+from typing import Dict, List, Tuple, Optional
+
+from sqlalchemy import func
+
+from database.models import Topic, Question
+from database.db_manager import get_session
+
+# Время жизни кэша списка тем в секундах
+TTL = 30
+
+_topics_cache = {"data": None, "ts": 0.0}
+_counts_cache = {"data": None, "ts": 0.0}
+_lock = threading.Lock()
+
+
+def get_topics_cached() -> List[Tuple[int, str, Optional[str]]]:
+    """Получение списка тем в виде кортежей (id, name, description) с кэшированием"""
+    with _lock:
+        if _topics_cache["data"] is not None and time.monotonic() - _topics_cache["ts"] <= TTL:
+            return _topics_cache["data"]
+
+    with get_session() as session:
+        data = [tuple(row) for row in session.query(Topic.id, Topic.name, Topic.description).all()]
+
+    with _lock:
+        _topics_cache["data"] = data
+        _topics_cache["ts"] = time.monotonic()
+    return data
+
+
+def get_question_counts() -> Dict[int, int]:
+    """Количество вопросов по темам {topic_id: count} одним агрегирующим запросом"""
+    with _lock:
+        if _counts_cache["data"] is not None and time.monotonic() - _counts_cache["ts"] <= TTL:
+            return _counts_cache["data"]
+
+    with get_session() as session:
+        # Один GROUP BY вместо ленивой загрузки topic.questions для каждой темы
+        rows = (
+            session.query(Topic.id, func.count(Question.id))
+            .outerjoin(Question, Question.topic_id == Topic.id)
+            .group_by(Topic.id)
+            .all()
+        )
+        data = dict(rows)
+
+    with _lock:
+        _counts_cache["data"] = data
+        _counts_cache["ts"] = time.monotonic()
+    return data
+
+
+def invalidate() -> None:
+    """Сброс кэша после добавления или изменения тем и вопросов"""
+    with _lock:
+        for cache in (_topics_cache, _counts_cache):
+            cache["data"] = None
+            cache["ts"] = 0.0
\ No newline at end of file